@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import timeit
+
+import main
+
+# the scenarios of the README: number of points and Simulator kwargs.
+# 20k-notree is left out by default, it takes minutes on CPython
+SCENARIOS = {
+	"20k": (20000, {"index_type": "pregenerated"}),
+	"20k-notree": (20000, {"use_tree": False}),
+	"100k": (100000, {"index_type": "inctree"}),
+}
+DEFAULT_SCENARIOS = ["20k", "100k"]
+
+def degree_placement(s, x, y, n):
+	# add_node geometry as it was done before Simulator.get_new_pos rotated
+	# unit vectors: through degrees, dcos and dsin for every candidate
+	x, y = x+s.a*main.dcos(n+s.beta), y+s.a*main.dsin(n+s.beta)
+	n = main.direction(x, y, s.t)
+	b1 = x+s.b*main.dcos(n+s.alpha), y+s.b*main.dsin(n+s.alpha)
+	b2 = x+s.b*main.dcos(n-s.alpha), y+s.b*main.dsin(n-s.alpha)
+	return (x, y), b1, b2
+
+def rotation_placement(s, x, y, ux, uy):
+	x, y = s.get_new_pos(x, y, s.a, ux, uy, s.cos_beta, s.sin_beta)
+	ux, uy = main.unit_nv(x, y, s.t)
+	b1 = s.get_new_pos(x, y, s.b, ux, uy, s.cos_alpha, s.sin_alpha)
+	b2 = s.get_new_pos(x, y, s.b, ux, uy, s.cos_alpha, -s.sin_alpha)
+	return (x, y), b1, b2
+
+def placement(number=100000):
+	s = main.Simulator(main.config, use_tree=False)
+	x, y = 123.4, 56.7
+	n = main.direction(x, y, s.t)
+	ux, uy = main.unit_nv(x, y, s.t)
+	old = degree_placement(s, x, y, n)
+	new = rotation_placement(s, x, y, ux, uy)
+	for p, q in zip(old, new):
+		assert main.close_enough(p[0], q[0]) and main.close_enough(p[1], q[1]), "placements differ: {} {}".format(old, new)
+	for name, stmt in [
+		("degrees", lambda: degree_placement(s, x, y, n)),
+		("rotation", lambda: rotation_placement(s, x, y, ux, uy)),
+	]:
+		best = min(timeit.repeat(stmt, number=number, repeat=3))
+		print("{}: {:.3f} us per node placement".format(name, best/number*1e6))
+
+def scenario(name, seed=1):
+	# run one scenario headless in this interpreter, the eps and csv files go
+	# to the working directory. the timings are printed as json on the last line
+	number, kwargs = SCENARIOS[name]
+	conf = dict(main.config, N=number)
+	ret = {"scenario": name, "interpreter": platform.python_version(), "implementation": platform.python_implementation()}
+	start = time.time()
+	s = main.Simulator(conf, seed=seed, headless=True, **kwargs)
+	ret["init"] = time.time()-start
+	start = time.time()
+	s.generate_first()
+	s.generate_it()
+	ret["generate"] = time.time()-start
+	start = time.time()
+	s.collect_data()
+	ret["save"] = time.time()-start
+	start = time.time()
+	s.draw(name)
+	ret["draw"] = time.time()-start
+	ret["points"] = len(s.points)
+	ret["generator"] = type(s.rng.generator).__name__
+	print(json.dumps(ret))
+	return ret
+
+def interpreters(paths, names=DEFAULT_SCENARIOS, seed=1):
+	# run the scenarios with every interpreter in a scratch directory and
+	# print a table. the random generator depends on the interpreter and on
+	# numpy being there, so the same seed does not give the same pattern
+	rows = list()
+	for path in paths:
+		for name in names:
+			workdir = tempfile.mkdtemp(prefix="benchmark-")
+			try:
+				output = subprocess.check_output([path, os.path.abspath(__file__), "scenario", name, "--seed", str(seed)], cwd=workdir)
+			finally:
+				shutil.rmtree(workdir)
+			row = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+			row["path"] = path
+			rows.append(row)
+	line = "{:<28} {:<12} {:>8} {:>8} {:>10} {:>8} {:>8}  {}"
+	print(line.format("interpreter", "scenario", "points", "init", "generate", "save", "draw", "generator"))
+	for row in rows:
+		print(line.format(
+			"{} {}".format(row["implementation"], row["interpreter"]), row["scenario"], row["points"],
+			"{:.2f}".format(row["init"]), "{:.2f}".format(row["generate"]), "{:.2f}".format(row["save"]), "{:.2f}".format(row["draw"]),
+			row["generator"]))
+	return rows
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser()
+	commands = parser.add_subparsers(dest="command")
+	p = commands.add_parser("placement", help="time candidate placement through degrees and through rotation")
+	p.add_argument("number", type=int, nargs="?", default=100000)
+	p = commands.add_parser("scenario", help="run one README scenario in this interpreter")
+	p.add_argument("name", choices=sorted(SCENARIOS))
+	p.add_argument("--seed", type=int, default=1)
+	p = commands.add_parser("interpreters", help="run README scenarios on every given interpreter, e.g. python2 python3 pypy3")
+	p.add_argument("paths", nargs="+")
+	p.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="default: {}".format(" ".join(DEFAULT_SCENARIOS)))
+	p.add_argument("--seed", type=int, default=1)
+	args = parser.parse_args()
+	if args.command == "scenario":
+		scenario(args.name, args.seed)
+	elif args.command == "interpreters":
+		interpreters(args.paths, args.scenario or DEFAULT_SCENARIOS, args.seed)
+	else:
+		placement(getattr(args, "number", 100000))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+from array import array
+import os
+import struct
+import sys
+import time
+
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
+
+# a checkpoint file is MAGIC, the length of a pickled header and the header,
+# then the raw bytes of the point columns, the frontier and the dead points.
+# the header holds the small things: config, Simulator options, bounds, the
+# rng state and the typecode and length of every array that follows. the
+# spatial index is not saved, it is bulk loaded from the points again
+MAGIC = b"TREESIM1"
+
+# steps generate runs between two looks at the clock
+CHUNK_STEPS = 10000
+
+replace = getattr(os, "replace", os.rename)
+
+def arrays(s):
+	return list(s.points.columns)+[s.to_generate.items, s.dead]
+
+def save(s, filename):
+	# written next to filename first, so a crash while saving keeps the last one
+	header = {
+		"conf": s.conf,
+		"options": s.options,
+		"bounds": (s.min_x, s.max_x, s.min_y, s.max_y),
+		"rng": s.rng.get_state(),
+		"byteorder": sys.byteorder,
+		"arrays": [(a.typecode, a.itemsize, len(a)) for a in arrays(s)],
+	}
+	data = pickle.dumps(header, 2)
+	tmp = filename+".tmp"
+	with open(tmp, "wb") as fp:
+		fp.write(MAGIC)
+		fp.write(struct.pack("<I", len(data)))
+		fp.write(data)
+		for a in arrays(s):
+			a.tofile(fp)
+	replace(tmp, filename)
+
+def load(cls, filename):
+	# a new cls (Simulator) in the state saved in filename
+	with open(filename, "rb") as fp:
+		if fp.read(len(MAGIC)) != MAGIC:
+			raise ValueError("{} is not a checkpoint".format(filename))
+		size, = struct.unpack("<I", fp.read(4))
+		header = pickle.loads(fp.read(size))
+		if header["byteorder"] != sys.byteorder:
+			raise ValueError("{} was saved on a {} endian machine".format(filename, header["byteorder"]))
+		loaded = list()
+		for typecode, itemsize, n in header["arrays"]:
+			a = array(typecode)
+			if a.itemsize != itemsize:
+				raise ValueError("{} was saved with {} byte '{}' arrays".format(filename, itemsize, typecode))
+			if n > 0:
+				a.fromfile(fp, n)
+			loaded.append(a)
+
+	s = cls(header["conf"], **header["options"])
+	points = s.points
+	names = points.column_names
+	for name, column in zip(names, loaded):
+		setattr(points, name, column)
+	items, s.dead = loaded[len(names):]
+	s.to_generate.extend(items)
+	for pid, m in enumerate(points.tree):
+		s.trees[m].append(pid)
+	s.min_x, s.max_x, s.min_y, s.max_y = header["bounds"]
+	s.rng.set_state(header["rng"])
+	s.insert_list_to_quadtree(range(len(points)))
+	return s
+
+def generate(s, filename, interval=60.0):
+	# s.generate_it(), saving s to filename every interval seconds and at the
+	# end. the steps taken do not depend on when it saves, so a run resumed
+	# from any of these files ends the same as an uninterrupted one
+	last = time.time()
+	while len(s.to_generate) > 0 and len(s.points) <= s.N:
+		s.generate_it(CHUNK_STEPS)
+		if time.time()-last >= interval:
+			start = time.time()
+			save(s, filename)
+			last = time.time()
+			print("checkpoint: {} points in {:.3f} seconds".format(len(s.points), last-start))
+	save(s, filename)
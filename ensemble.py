@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+import itertools
+import multiprocessing
+import os
+import time
+
+import main
+import rng
+
+# a job is a dict: name, seed, overrides and output_dir. an override whose
+# key is in main.config changes the config of that run, any other override
+# is passed to Simulator as a keyword argument (index_type, retire_blocked...)
+
+SUMMARY_COLUMNS = ["name", "seed", "N", "points", "edges", "to_generate", "min_x", "max_x", "min_y", "max_y", "init", "generate", "save", "draw"]
+
+def make_jobs(seeds, overrides=None, variations=None, output_root="ensemble"):
+	# one job per seed and combination of variations. variations maps a key
+	# to the list of values to try, overrides apply to every job
+	overrides = dict(overrides or {})
+	variations = variations or {}
+	keys = sorted(variations)
+	jobs = list()
+	for values in itertools.product(*[variations[k] for k in keys]):
+		job_overrides = dict(overrides)
+		job_overrides.update(zip(keys, values))
+		label = "_".join("{}={}".format(k, v) for k, v in zip(keys, values))
+		for seed in seeds:
+			name = "{}_seed={}".format(label, seed) if label else "seed={}".format(seed)
+			jobs.append({
+				"name": name,
+				"seed": seed,
+				"overrides": job_overrides,
+				"output_dir": os.path.join(output_root, name),
+			})
+	return jobs
+
+def run_job(job):
+	# one headless run, the same steps as main.check_generation
+	conf = dict(main.config)
+	kwargs = {"use_tree": main.tree_version}
+	for key, value in job["overrides"].items():
+		if key in conf:
+			conf[key] = value
+		else:
+			kwargs[key] = value
+	draw = kwargs.pop("draw", True)
+	output_dir = job["output_dir"]
+	if not os.path.isdir(output_dir):
+		os.makedirs(output_dir)
+	ret = {"name": job["name"], "seed": job["seed"], "N": conf["N"]}
+	start = time.time()
+	s = main.Simulator(conf, seed=job["seed"], headless=True, output_dir=output_dir, **kwargs)
+	ret["init"] = time.time()-start
+	start = time.time()
+	s.generate_first()
+	s.generate_it()
+	ret["generate"] = time.time()-start
+	start = time.time()
+	s.collect_data()
+	ret["save"] = time.time()-start
+	start = time.time()
+	if draw is True:
+		s.draw(job["name"])
+	ret["draw"] = time.time()-start
+	ret["points"] = len(s.points)
+	ret["edges"] = s.points.edge_count
+	ret["to_generate"] = len(s.to_generate)
+	ret["min_x"], ret["max_x"] = s.min_x, s.max_x
+	ret["min_y"], ret["max_y"] = s.min_y, s.max_y
+	return ret
+
+def run_ensemble(jobs, processes=None):
+	# run the jobs on a pool of processes (one per core by default), the
+	# results come back in the order of jobs
+	results = [None]*len(jobs)
+	pool = multiprocessing.Pool(processes)
+	try:
+		for i, result in pool.imap_unordered(run_indexed, list(enumerate(jobs))):
+			results[i] = result
+			print("{name}: {points} points in {generate:.2f} s".format(**result))
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+	return results
+
+def run_indexed(indexed_job):
+	i, job = indexed_job
+	return i, run_job(job)
+
+def format_value(value):
+	if isinstance(value, float):
+		return "{:.2f}".format(value)
+	return str(value)
+
+def summary_table(results):
+	rows = [SUMMARY_COLUMNS] + [[format_value(r[c]) for c in SUMMARY_COLUMNS] for r in results]
+	widths = [max(len(row[i]) for row in rows) for i in range(len(SUMMARY_COLUMNS))]
+	return "\n".join("  ".join(v.rjust(w) for v, w in zip(row, widths)) for row in rows)
+
+def save_summary(results, filename):
+	with open(filename, "w") as fp:
+		fp.write(",".join(SUMMARY_COLUMNS)+"\n")
+		for r in results:
+			fp.write(",".join(str(r[c]) for c in SUMMARY_COLUMNS)+"\n")
+
+def parse_value(text):
+	# numbers, True/False/None, anything else stays a string
+	if text in ("True", "False", "None"):
+		return {"True": True, "False": False, "None": None}[text]
+	for kind in (int, float):
+		try:
+			return kind(text)
+		except ValueError:
+			pass
+	return text
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description="run many independent simulations in parallel")
+	parser.add_argument("-n", "--runs", type=int, default=4, help="number of seeds, starting at --seed")
+	parser.add_argument("--seed", type=int, default=None, help="first seed, default from the clock")
+	parser.add_argument("--seeds", type=int, nargs="+", help="explicit seeds, instead of --runs and --seed")
+	parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="override a config key or Simulator option in every run, e.g. N=20000 or index_type=grid")
+	parser.add_argument("--vary", action="append", default=[], metavar="KEY=V1,V2", help="run every seed with each of these values")
+	parser.add_argument("--no-draw", dest="draw", action="store_false", help="only write the csv files")
+	parser.add_argument("-j", "--processes", type=int, default=None, help="default: number of cores")
+	parser.add_argument("-o", "--output", default="ensemble", help="every run writes to a directory in here")
+	args = parser.parse_args()
+
+	if args.seeds:
+		seeds = args.seeds
+	else:
+		first = args.seed if args.seed is not None else rng.clock_seed()
+		seeds = list(range(first, first+args.runs))
+	overrides = dict((k, parse_value(v)) for k, v in (item.split("=", 1) for item in args.set))
+	overrides["draw"] = args.draw
+	variations = dict((k, [parse_value(v) for v in vs.split(",")]) for k, vs in (item.split("=", 1) for item in args.vary))
+	jobs = make_jobs(seeds, overrides, variations, args.output)
+	start = time.time()
+	results = run_ensemble(jobs, args.processes)
+	print("{} runs in {:.2f} s".format(len(results), time.time()-start))
+	print(summary_table(results))
+	save_summary(results, os.path.join(args.output, "summary.csv"))
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+from array import array
+
+class Frontier(object):
+	# point ids still to grow, with O(1) append, indexing and removal.
+	# position[pid] is the index of pid in items, -1 when it is not in there.
+	# remove moves the last item into the hole, so the order is not kept,
+	# which does not matter to a uniform pick by index
+	def __init__(self):
+		self.items = array("i")
+		self.position = array("i")
+
+	def __len__(self):
+		return len(self.items)
+
+	def __getitem__(self, i):
+		return self.items[i]
+
+	def __iter__(self):
+		return iter(self.items)
+
+	def __contains__(self, pid):
+		return pid < len(self.position) and self.position[pid] >= 0
+
+	def append(self, pid):
+		position = self.position
+		if pid >= len(position):
+			position.extend([-1]*(pid+1-len(position)))
+		position[pid] = len(self.items)
+		self.items.append(pid)
+
+	def extend(self, pids):
+		for pid in pids:
+			self.append(pid)
+
+	def remove(self, pid):
+		i = self.position[pid]
+		if i < 0:
+			raise ValueError("point {} is not in the frontier".format(pid))
+		last = self.items.pop()
+		if last != pid:
+			self.items[i] = last
+			self.position[last] = i
+		self.position[pid] = -1
+
+	def __repr__(self):
+		return "Frontier<points={}>".format(len(self))
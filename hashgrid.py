@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+from math import floor, ceil
+
+class Cell(object):
+	__slots__ = ("items",)
+
+	def __init__(self):
+		self.items = list()
+
+class HashGrid(object):
+	# uniform grid keyed by integer cell coordinates, only the cells that hold
+	# items are stored. when cell_size is not less than the query radius, every
+	# item within the radius is in the 3x3 cells around the query point.
+	# items are point ids of points, a pointstore.PointStore
+	def __init__(self, cell_size, points):
+		self.cell_size = cell_size
+		self.points = points
+		self.cells = dict()
+		self.offsets_by_span = dict()
+		# a metrics.Metrics counting queries and visited cells (as nodes)
+		self.metrics = None
+
+	def generate_tree(self):
+		pass
+
+	def cell_key(self, x, y):
+		return int(floor(x/self.cell_size)), int(floor(y/self.cell_size))
+
+	def find_leaf(self, x, y):
+		return self.cells.get(self.cell_key(x, y))
+
+	def find_items(self, x, y):
+		leaf = self.find_leaf(x, y)
+		if leaf is None:
+			return None
+		else:
+			return leaf.items
+
+	def find_leaves(self, x, y, r):
+		cx, cy = self.cell_key(x, y)
+		span = int(ceil(r/self.cell_size))
+		cells = self.cells
+		ret = list()
+		for i in range(cx-span, cx+span+1):
+			for j in range(cy-span, cy+span+1):
+				cell = cells.get((i, j))
+				if cell is not None:
+					ret.append(cell)
+		return ret
+
+	def neighbour_offsets(self, span):
+		# cell offsets within span, the centre cell first and the corners last
+		offsets = self.offsets_by_span.get(span)
+		if offsets is None:
+			offsets = [(i, j) for i in range(-span, span+1) for j in range(-span, span+1)]
+			offsets.sort(key=lambda o: o[0]*o[0]+o[1]*o[1])
+			self.offsets_by_span[span] = offsets
+		return offsets
+
+	def any_within(self, x, y, r, radius_fn):
+		# same contract as quadtree.Node.any_within
+		metrics = self.metrics
+		if metrics is not None:
+			metrics.count("index.queries")
+		cx, cy = self.cell_key(x, y)
+		cells = self.cells
+		px, py = self.points.x, self.points.y
+		for i, j in self.neighbour_offsets(int(ceil(r/self.cell_size))):
+			cell = cells.get((cx+i, cy+j))
+			if cell is None:
+				continue
+			if metrics is not None:
+				metrics.count("index.nodes_visited")
+			for item in cell.items:
+				dis = radius_fn(item)
+				if dis is None:
+					continue
+				dx = px[item]-x
+				dy = py[item]-y
+				if dx*dx+dy*dy < dis*dis:
+					return True
+		return False
+
+	def add_item(self, item):
+		key = self.cell_key(self.points.x[item], self.points.y[item])
+		cell = self.cells.get(key)
+		if cell is None:
+			cell = Cell()
+			self.cells[key] = cell
+		cell.items.append(item)
+		return True
+
+	def extend_items(self, items):
+		for item in items:
+			self.add_item(item)
+
+	def __repr__(self):
+		return "HashGrid<cell_size={cell_size}, cells={cells}>".format(cell_size=self.cell_size, cells=len(self.cells))
+
+if __name__ == "__main__":
+	# compare against quadtree.IncTree with the bounds Simulator.init_quadtree uses
+	import sys
+	import time
+	import random
+	import quadtree
+	import pointstore
+
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	r = 1.0
+	side = r*0.85
+	lower = -(n+2)*side
+	length = 300+2*(n+2)*side
+	# roughly the density of a generated pattern: about one point per r*r
+	half = (n**0.5)/2
+	random.seed(0)
+	points = pointstore.PointStore()
+	for _ in range(n):
+		points.add(150+random.uniform(-half, half), 150+random.uniform(-half, half), 0.2, 1.0, 0.0, 0)
+	queries = [(points.x[p]+random.uniform(-r, r), points.y[p]+random.uniform(-r, r)) for p in random.sample(range(n), min(n, 100000))]
+
+	for name, index in [
+		("IncTree", quadtree.IncTree(lower, lower, length, length, 0, 2*r, points=points)),
+		("HashGrid", HashGrid(r, points)),
+	]:
+		start = time.time()
+		for p in range(n):
+			index.add_item(p)
+		insert_time = time.time()-start
+		start = time.time()
+		found = 0
+		for x, y in queries:
+			for leaf in index.find_leaves(x, y, r):
+				found += len(leaf.items)
+		query_time = time.time()-start
+		print("{}: insert {} points {:.3f} s, {} queries {:.3f} s, {} items scanned".format(name, n, insert_time, len(queries), query_time, found))
@@ -2,20 +2,47 @@
 
 from __future__ import division
 import os
+import time
+
+import_start = time.time()
 
-import graphics
 import quadtree
+import hashgrid
+import pointstore
+import frontier
 import psdrawer
+import rng
+import parallel
+import checkpoint
+import sinks
+import pipeline
+import metrics
+import profiling
 
-from math import tan, radians, sin, cos, degrees, atan, pi
-import random
-import time
+from math import tan, radians, sin, cos, degrees, atan, pi, sqrt
+from array import array
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
-random.seed(time.time())
+try:
+	input = raw_input
+except NameError:
+	pass
+
+# graphics creates a Tk root when it is imported, which needs a display, so
+# it is only imported by load_graphics when a window is opened
+graphics = None
+
+import_time = time.time()-import_start
 
 MAX_DRAW_CIRCLES = 10000
 eps_filename = "draw.eps"
 ps_filename = "draw.ps"
+# directory collect_data and draw write their files to
+output_dir = "."
 
 max_width = 1200
 max_height = 675
@@ -24,6 +51,59 @@ random_x_range = (0, 300)
 random_y_range = (0, 300)
 
 tree_version = True
+# spatial index used when tree_version is True: "inctree", "flat", "pregenerated" or "grid"
+index_type = "inctree"
+# leaf capacity of the "inctree" index, None pushes every point down to min_size
+bucket_size = None
+# keep the bounding box of the points in every "inctree" leaf for tighter pruning
+tight_bounds = False
+# start "inctree" queries from the leaf of the previous query instead of the root
+finger_search = False
+# depth limit of the "flat" index. it spawns nodes as points arrive, so a deep
+# limit only costs nodes where there are points, leaves stop at min_size anyway
+max_depth = quadtree.BUCKET_MAX_DEPTH
+# check the node and both balls of add_node with one spatial query. it passes
+# exactly the placements the three separate checks pass
+batch_check = False
+# also reject an add_node whose node and balls break the distance rules among
+# themselves, i.e. b1 and b2 closer than max(a, b, c, e). this changes the
+# model: the original only checks every one of them against the points
+# already placed, and with 2*b*sin(alpha) < max(a, b, c, e) it rejects every node
+check_siblings = False
+# move frontier points whose four placements all failed out of to_generate
+# into Simulator.dead. such a point can only ever be dropped by the p3 branch,
+# so the generated pattern follows the same distribution either way, only the
+# number of iterations and the final to_generate differ (see README)
+retire_blocked = False
+# seed of Simulator.rng, None seeds from the clock. the seed in use is printed
+seed = None
+# split generate_it over this many worker processes, see parallel.py. 0 or 1
+# runs it serially
+parallel_workers = 0
+# save the generation to this file every checkpoint_interval seconds, see
+# checkpoint.py. with resume the run continues from the file when it exists
+checkpoint_file = None
+checkpoint_interval = 60
+resume = False
+# write the csv and eps files batch by batch while generating instead of
+# after it, see sinks.py. always headless
+streaming = False
+# with streaming, run every sink on its own writer thread fed through a
+# bounded queue, see pipeline.py
+writer_threads = False
+# never open a window, draw only writes the eps file and graphics is not imported
+headless = False
+# count checks, rejections, index nodes visited and frontier sizes and time the
+# phases of a run, see metrics.py. metrics_file is where they are saved as json
+collect_metrics = False
+metrics_file = None
+# profile the sections of a run (generation, collect_data, circles, lines) into
+# this directory, see profiling.py. profile_steps = (start, stop) profiles
+# only these steps of generate_it, e.g. the crowded late phase. without
+# profile_cprofile only the stacks are sampled
+profile_dir = None
+profile_steps = None
+profile_cprofile = True
 
 draw_circles = True
 draw_lines = True
@@ -46,10 +126,18 @@ config = {
 	"N": 400000,
 }
 
-def new_nv(x, y):
-	t = config["t"]
+def new_nv(x, y, t):
+	# growth vector at (x, y), t is the "t" of the config
 	return (cos(x/t-pi/2), (pi/2-x/t)*cos(y/t))
 
+# bits of PointStore.blocked, one per placement a frontier point can try,
+# indexed by side (0 turns by +beta, 1 by -beta)
+BALL_BLOCKED = (1, 2)
+NODE_BLOCKED = (4, 8)
+ALL_BLOCKED = 15
+# metrics counter of the steps of every choice
+STEP_COUNTERS = ("steps.ball", "steps.node", "steps.remove")
+
 background_color = "white"
 circle_color = "black"
 line_color = "black"
@@ -68,16 +156,35 @@ def dcos(d):
 	return cos(radians(d))
 
 class CheckTime(object):
-	def __init__(self, name):
+	# with a Metrics the time is also kept there, nested in the timers running,
+	# with a profiling.Profiler the block is profiled as a section of its own
+	def __init__(self, name, metrics=None, profiler=None):
 		self.name = name
+		self.metrics = metrics
+		self.profiler = profiler
 
 	def __enter__(self):
 		self.start = time.time()
+		if self.metrics is not None:
+			self.metrics.start(self.name)
+		if self.profiler is not None:
+			self.profiler.start(self.name)
 		return self
 
 	def __exit__(self, exc_type, exc_value, exc_tb):
+		if self.profiler is not None:
+			self.profiler.stop()
+		if self.metrics is not None:
+			self.metrics.stop()
 		print("{}: {} seconds".format(self.name, time.time()-self.start))
 
+def load_graphics():
+	global graphics
+	if graphics is None:
+		with CheckTime("graphics import time") as ct:
+			import graphics
+	return graphics
+
 class Vector(object):
 	def __init__(self, x, y):
 		self.x = x
@@ -97,42 +204,41 @@ class Vector(object):
 			ret = ret + 180.0
 		return ret
 
-class BaseP(object):
-	def __init__(self, idx, x, y, r, parent=None):
-		self.x = x
-		self.y = y
-		self.r = r
-		self.idx = idx
-		self.parent = parent
-		self.is_endpoint = True
-		self.is_node = False
-
-	@property
-	def n(self):
-		return self.nv.degree
-
-	@property
-	def nv(self):
-		return Vector(*(new_nv(self.x, self.y)))
-
-class Ball(BaseP):
-	def __init__(self, idx, x, y, parent=None):
-		super(Ball, self).__init__(idx, x, y, config["r1"], parent)
-
-class Node(BaseP):
-	def __init__(self, idx, x, y, parent=None):
-		super(Node, self).__init__(idx, x, y, config["r2"], parent)
-		self.is_node = True
-
-class Line(object):
-	def __init__(self, parent, child):
-		self.x1 = parent.x
-		self.x2 = child.x
-		self.y1 = parent.y
-		self.y2 = child.y
+def direction(x, y, t):
+	# growth direction at (x, y) in degrees
+	return Vector(*(new_nv(x, y, t))).degree
+
+def unit_nv(x, y, t):
+	# new_nv scaled to length 1, i.e. (cos, sin) of direction(x, y, t)
+	nx, ny = new_nv(x, y, t)
+	length = sqrt(nx*nx+ny*ny)
+	if length == 0.0:
+		raise RuntimeError("please tell me what's direction of vector (0,0)...")
+	return nx/length, ny/length
+
+def directions(xs, ys, t):
+	# direction() of many points at once, vectorized when numpy is available
+	if numpy is None:
+		return [direction(x, y, t) for x, y in zip(xs, ys)]
+	xs = numpy.asarray(xs, dtype=float)
+	ys = numpy.asarray(ys, dtype=float)
+	nx = numpy.cos(xs/t-pi/2)
+	ny = (pi/2-xs/t)*numpy.cos(ys/t)
+	vertical = nx == 0.0
+	if numpy.any(vertical & (ny == 0.0)):
+		raise RuntimeError("please tell me what's direction of vector (0,0)...")
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		ret = numpy.degrees(numpy.arctan(ny/nx))
+	ret[nx < 0] += 180.0
+	ret[vertical] = numpy.where(ny[vertical] > 0, 90.0, -90.0)
+	return ret
 
 class Simulator(object):
 	def __init__(self, conf, **kwargs):
+		# kept to build more Simulators like this one, e.g. in parallel workers
+		self.conf = conf
+		self.options = kwargs
+		self.t = conf["t"]
 		self.a = conf["a"]
 		self.b = conf["b"]
 		self.c = conf["c"]
@@ -142,6 +248,9 @@ class Simulator(object):
 		self.r2 = conf["r2"]
 		self.alpha = conf["alpha"]
 		self.beta = conf["beta"]
+		# candidates are placed by rotating the unit direction, no angles needed
+		self.cos_alpha, self.sin_alpha = dcos(self.alpha), dsin(self.alpha)
+		self.cos_beta, self.sin_beta = dcos(self.beta), dsin(self.beta)
 		self.p1 = conf["p1"]
 		self.p2 = conf["p2"]
 		self.p3 = conf["p3"]
@@ -154,17 +263,36 @@ class Simulator(object):
 		self.max_y = float("-inf")
 		self.min_x = float("inf")
 		self.min_y = float("inf")
-		self.to_generate = list()
+		self.to_generate = frontier.Frontier()
 		self.trees = list()
-		self.all_p = list()
-		self.lines = list()
-		for m in xrange(self.M):
-			self.trees.append(list())
+		self.points = pointstore.PointStore()
+		for m in range(self.M):
+			self.trees.append(array("i"))
 		self.use_tree = kwargs.get("use_tree", True)
+		self.index_type = kwargs.get("index_type", index_type)
+		self.bucket_size = kwargs.get("bucket_size", bucket_size)
+		self.tight_bounds = kwargs.get("tight_bounds", tight_bounds)
+		self.finger_search = kwargs.get("finger_search", finger_search)
+		self.max_depth = kwargs.get("max_depth", max_depth)
+		self.batch_check = kwargs.get("batch_check", batch_check)
+		self.check_siblings = kwargs.get("check_siblings", check_siblings)
+		self.retire_blocked = kwargs.get("retire_blocked", retire_blocked)
+		self.dead = array("i")
+		self.headless = kwargs.get("headless", headless)
+		self.output_dir = kwargs.get("output_dir", output_dir)
+		self.rng = rng.BlockRandom(kwargs.get("seed", seed), (self.p1, self.p2, self.p3))
+		self.metrics = metrics.Metrics() if kwargs.get("metrics", collect_metrics) is True else None
+		# a profiling.Profiler draw profiles circles and lines with
+		self.profiler = None
 		if self.use_tree is True:
 			self.init_quadtree()
 
 	def init_quadtree(self):
+		if self.index_type == "grid":
+			# every query asks the same radius, so one cell side covers it
+			self.quadtree = hashgrid.HashGrid(max(self.d, self.a, self.b, self.c, self.e), self.points)
+			self.quadtree.metrics = self.metrics
+			return
 		theta = min(abs(self.alpha), abs(self.beta))
 		r = max(self.a, self.b, self.c)
 		side_length = r*dcos(theta)
@@ -173,8 +301,18 @@ class Simulator(object):
 		y = random_y_range[0] - (self.N+2)*side_length
 		uy = random_y_range[1] + (self.N+2)*side_length
 		min_size = 2 * r
-		#self.quadtree = quadtree.Node(x, y, ux-x, uy-y, 0, min_size)
-		self.quadtree = quadtree.IncTree(x, y, ux-x, uy-y, 0, min_size)
+		if self.index_type == "pregenerated":
+			self.quadtree = quadtree.Node(x, y, ux-x, uy-y, 0, min_size, self.points)
+		elif self.index_type == "inctree":
+			self.quadtree = quadtree.IncTree(x, y, ux-x, uy-y, 0, min_size, self.bucket_size, self.tight_bounds, self.finger_search, self.points)
+		elif self.index_type == "flat":
+			self.quadtree = quadtree.FlatTree(x, y, ux-x, uy-y, 0, min_size, self.max_depth, self.points)
+			self.quadtree.metrics = self.metrics
+			# FlatTree.add_item spawns the nodes on the way down
+			return
+		else:
+			raise ValueError("unknown index type {}".format(self.index_type))
+		self.quadtree.metrics = self.metrics
 		self.quadtree.generate_tree()
 
 	def insert_to_quadtree(self, point):
@@ -185,166 +323,277 @@ class Simulator(object):
 		if self.quadtree is not None:
 			self.quadtree.extend_items(points)
 
-	def modify_bound(self, *points):
-		for p in list(points):
-			x, y = p.x, p.y
-			if x > self.max_x:
-				self.max_x = x
-			if x < self.min_x:
-				self.min_x = x
-			if y > self.max_y:
-				self.max_y = y
-			if y < self.min_y:
-				self.min_y = y
+	def reindex(self):
+		# rebuild the spatial index from all points in one bulk load
+		if self.use_tree is True:
+			self.init_quadtree()
+			self.insert_list_to_quadtree(range(len(self.points)))
+
+	def load_points(self, filename="points.csv"):
+		# read back the output of save_points, e.g. for analysis. parents and
+		# the frontier are not saved there, so the loaded points can not be grown
+		r2 = self.r2
+		with open(filename, "r") as fp:
+			fp.readline()
+			for line in fp:
+				x, y, r, n, idx = line.split(",")
+				x, y, r, idx = float(x), float(y), float(r), int(idx)
+				self.add_point(x, y, r, idx, -1, close_enough(r, r2))
+		self.reindex()
+
+	def add_point(self, x, y, r, idx, parent=-1, is_node=False, u=None):
+		ux, uy = unit_nv(x, y, self.t) if u is None else u
+		pid = self.points.add(x, y, r, ux, uy, idx, parent, is_node)
+		self.modify_bound(x, y)
+		self.trees[idx].append(pid)
+		return pid
+
+	def add_points(self, x, y, r, ux, uy, idx, parent, is_node):
+		# add_point for columns of points with known directions, not indexed
+		pids = self.points.extend(x, y, r, ux, uy, idx, parent, is_node)
+		if len(pids) > 0:
+			self.modify_bound(max(x), max(y))
+			self.modify_bound(min(x), min(y))
+		trees = self.trees
+		for pid, m in zip(pids, idx):
+			trees[m].append(pid)
+		return pids
+
+	def modify_bound(self, x, y):
+		if x > self.max_x:
+			self.max_x = x
+		if x < self.min_x:
+			self.min_x = x
+		if y > self.max_y:
+			self.max_y = y
+		if y < self.min_y:
+			self.min_y = y
 
 	def generate_first(self):
-		for m in xrange(self.M):
+		xs, ys = self.points.x, self.points.y
+		for m in range(self.M):
 			while True:
-				ball = Ball(m, random.randrange(*random_x_range), random.randrange(*random_y_range))
+				x, y = self.rng.randrange(*random_x_range), self.rng.randrange(*random_y_range)
 				for p in self.to_generate:
-					if self.distance_square(ball, p) < self.d*self.d:
+					if self.distance_square(x, y, xs[p], ys[p]) < self.d*self.d:
 						break
 				else:	
-					self.modify_bound(ball)
+					ball = self.add_point(x, y, self.r1, m)
 					self.to_generate.append(ball)
-					self.trees[m].append(ball)
-					self.all_p.append(ball)
 					self.insert_to_quadtree(ball)
 					break
 		print("inited it")
 
-	def get_choice(self):
-		choice = random.random()
-		if 0 <= choice < self.p1:
-			return 0
-		elif self.p1 <= choice < self.p1+self.p2:
-			return 1
-		else:
-			return 2
-
-	def get_new_pos(self, parent, dis, degree):
-		x, y = parent.x, parent.y
-		return x + dis*dcos(degree), y+dis*dsin(degree)
+	def get_new_pos(self, x, y, dis, ux, uy, cos_t, sin_t):
+		# step dis from (x, y) along the unit direction (ux, uy) turned by t
+		return x+dis*(ux*cos_t-uy*sin_t), y+dis*(ux*sin_t+uy*cos_t)
 
-	def distance_square(self, p1, p2):
-		x_diff = p1.x-p2.x
-		y_diff = p1.y-p2.y
+	def distance_square(self, x1, y1, x2, y2):
+		x_diff = x1-x2
+		y_diff = y1-y2
 		return x_diff*x_diff+y_diff*y_diff
 
-	def old_check_position(self, point):
-		for idx in xrange(self.M):
-			if idx == point.idx:
+	# a candidate position is checked as (x, y, idx, parent): idx is the tree
+	# it would join and parent a point id, or the parent's candidate tuple when
+	# both are placed in the same batch
+
+	def old_check_position(self, x, y, idx, parent):
+		xs, ys = self.points.x, self.points.y
+		for m in range(self.M):
+			if m == idx:
 				continue
-			for p in self.trees[idx]:
-				if self.distance_square(point, p) < self.d*self.d:
+			for p in self.trees[m]:
+				if self.distance_square(x, y, xs[p], ys[p]) < self.d*self.d:
 					return False
 		same_tree_d = max(self.a, self.b, self.c, self.e)
-		for p in self.trees[point.idx]:
-			if p is not point.parent and self.distance_square(point, p) < same_tree_d*same_tree_d:
+		for p in self.trees[idx]:
+			if p != parent and self.distance_square(x, y, xs[p], ys[p]) < same_tree_d*same_tree_d:
 				return False
 		return True
 
-	def new_check_position(self, point):
+	def new_check_position(self, x, y, idx, parent):
 		diff_tree_d = self.d
 		same_tree_d = max(self.a, self.b, self.c, self.e)
 		r = max(diff_tree_d, same_tree_d)
-		x, y = point.x, point.y
-		leaves = self.quadtree.find_leaves(x, y, r)
-		for leaf in leaves:
-			for item in leaf.items:
-				if item.idx == point.idx:
-					if item is point.parent:
-						continue
-					else:
-						dis = same_tree_d
-				else:
-					dis = diff_tree_d
-				if self.distance_square(point, item) < dis*dis:
+		tree = self.points.tree
+		def radius_fn(item):
+			if tree[item] == idx:
+				if item == parent:
+					return None
+				return same_tree_d
+			return diff_tree_d
+		if self.metrics is not None:
+			radius_fn = self.metrics.counted("index.items_compared", radius_fn)
+		return not self.quadtree.any_within(x, y, r, radius_fn)
+
+	def check_position(self, x, y, idx, parent):
+		if self.metrics is not None:
+			self.metrics.count("check_position.calls")
+		if self.use_tree is True:
+			return self.new_check_position(x, y, idx, parent)
+		else:
+			return self.old_check_position(x, y, idx, parent)
+
+	def check_each_other(self, candidates):
+		# the rules among candidates placed together, only with check_siblings
+		same_tree_d = max(self.a, self.b, self.c, self.e)
+		for i, p in enumerate(candidates):
+			for q in candidates[i+1:]:
+				if p is q[3] or q is p[3]:
+					continue
+				dis = same_tree_d if p[2] == q[2] else self.d
+				if self.distance_square(p[0], p[1], q[0], q[1]) < dis*dis:
 					return False
 		return True
 
-	def check_position(self, point):
-		if self.use_tree is True:
-			return self.new_check_position(point)
+	def new_check_positions(self, candidates):
+		# one nearest-first query around the union of the candidates, every
+		# item met is tested against all candidates at once
+		diff_tree_d = self.d
+		same_tree_d = max(self.a, self.b, self.c, self.e)
+		r = max(diff_tree_d, same_tree_d)
+		cx = sum(c[0] for c in candidates)/len(candidates)
+		cy = sum(c[1] for c in candidates)/len(candidates)
+		spread = max(self.distance_square(c[0], c[1], cx, cy) for c in candidates)**0.5
+		xs, ys, tree = self.points.x, self.points.y, self.points.tree
+		same_d2 = same_tree_d*same_tree_d
+		diff_d2 = diff_tree_d*diff_tree_d
+		# any_within reports the first item whose radius exceeds its distance to
+		# the centre, so a conflicting item gets an infinite radius
+		conflict = float("inf")
+		def radius_fn(item):
+			ix, iy, iidx = xs[item], ys[item], tree[item]
+			for x, y, idx, parent in candidates:
+				if iidx == idx:
+					if item == parent:
+						continue
+					dis2 = same_d2
+				else:
+					dis2 = diff_d2
+				dx = ix-x
+				dy = iy-y
+				if dx*dx+dy*dy < dis2:
+					return conflict
+			return None
+		if self.metrics is not None:
+			radius_fn = self.metrics.counted("index.items_compared", radius_fn)
+		return not self.quadtree.any_within(cx, cy, r+spread, radius_fn)
+
+	def check_positions(self, candidates):
+		if self.metrics is not None:
+			self.metrics.count("check_positions.calls")
+		if self.check_siblings is True and not self.check_each_other(candidates):
+			if self.metrics is not None:
+				self.metrics.count("check_positions.each_other_rejected")
+			return False
+		if self.use_tree is True and self.batch_check is True:
+			return self.new_check_positions(candidates)
 		else:
-			return self.old_check_position(point)
-
-	def get_new_p(self, parent, cls, dis):
-		x, y, idx = parent.x, parent.y, parent.idx
-		point = cls(parent.idx, parent.x, parent.y, parent)
-		n = parent.n
-		rand = random.random()
-		if rand < 0.5:
-			degree = n+self.beta
+			return all(self.check_position(*c) for c in candidates)
+
+	def get_new_p(self, parent, dis, side):
+		points = self.points
+		if side == 0:
+			sin_t = self.sin_beta
 		else:
-			degree = n-self.beta
-		point.x, point.y = self.get_new_pos(parent, dis, degree)
-		return point
-
-	def get_new_ball(self, parent):
-		return self.get_new_p(parent, Ball, self.c)
-
-	def get_new_node(self, parent):
-		return self.get_new_p(parent, Node, self.a)
-
-	def add_ball(self, parent):
-		ball = self.get_new_ball(parent)
-		idx = ball.idx
-		if self.check_position(ball):
-			parent.is_endpoint = False
-			self.lines.append(Line(parent, ball))
-			self.modify_bound(ball)
-			self.trees[idx].append(ball)
+			sin_t = -self.sin_beta
+		return self.get_new_pos(points.x[parent], points.y[parent], dis, points.ux[parent], points.uy[parent], self.cos_beta, sin_t)
+
+	def get_new_ball(self, parent, side):
+		return self.get_new_p(parent, self.c, side)
+
+	def get_new_node(self, parent, side):
+		return self.get_new_p(parent, self.a, side)
+
+	# a frontier point only has the ball and node placements on either side
+	# to try. points are never removed, so once a placement fails its check it
+	# fails forever: the failure is remembered in PointStore.blocked and the
+	# placement is not checked again. a placement that passes is taken at once,
+	# so there is nothing else to remember and nothing to invalidate
+
+	def add_ball(self, parent, side):
+		points = self.points
+		if points.blocked[parent] & BALL_BLOCKED[side]:
+			if self.metrics is not None:
+				self.metrics.count("skipped_blocked.ball")
+			return False
+		idx = points.tree[parent]
+		x, y = self.get_new_ball(parent, side)
+		if self.check_position(x, y, idx, parent):
+			points.is_endpoint[parent] = False
+			ball = self.add_point(x, y, self.r1, idx, parent)
 			self.to_generate.append(ball)
-			self.all_p.append(ball)
 			self.insert_to_quadtree(ball)
 			return True
+		if self.metrics is not None:
+			self.metrics.count("rejected.ball")
+		self.block(parent, BALL_BLOCKED[side])
 		return False
 
-	def add_node(self, parent):
-		node = self.get_new_node(parent)
-		x, y, idx = node.x, node.y, node.idx
-		b1 = Ball(idx, x, y, node)
-		b2 = Ball(idx, x, y, node)
-		n = node.n
-		b1.x, b1.y = self.get_new_pos(node, self.b, n+self.alpha)
-		b2.x, b2.y = self.get_new_pos(node, self.b, n-self.alpha)
-		if self.check_position(node) and self.check_position(b1) and self.check_position(b2):
-			parent.is_endpoint = False
-			node.is_endpoint = False
-			self.lines.extend([Line(parent, node), Line(node, b1), Line(node, b2)])
-			self.modify_bound(node, b1, b2)
-			self.trees[idx].extend([node, b1, b2])
+	def add_node(self, parent, side):
+		points = self.points
+		if points.blocked[parent] & NODE_BLOCKED[side]:
+			if self.metrics is not None:
+				self.metrics.count("skipped_blocked.node")
+			return False
+		idx = points.tree[parent]
+		x, y = self.get_new_node(parent, side)
+		ux, uy = unit_nv(x, y, self.t)
+		b1x, b1y = self.get_new_pos(x, y, self.b, ux, uy, self.cos_alpha, self.sin_alpha)
+		b2x, b2y = self.get_new_pos(x, y, self.b, ux, uy, self.cos_alpha, -self.sin_alpha)
+		node = (x, y, idx, parent)
+		if self.check_positions([node, (b1x, b1y, idx, node), (b2x, b2y, idx, node)]):
+			points.is_endpoint[parent] = False
+			node = self.add_point(x, y, self.r2, idx, parent, True, (ux, uy))
+			points.is_endpoint[node] = False
+			b1 = self.add_point(b1x, b1y, self.r1, idx, node)
+			b2 = self.add_point(b2x, b2y, self.r1, idx, node)
 			self.to_generate.extend([b1, b2])
-			self.all_p.extend([node, b1, b2])
 			self.insert_list_to_quadtree([node, b1, b2])
 			return True
+		if self.metrics is not None:
+			self.metrics.count("rejected.node")
+		self.block(parent, NODE_BLOCKED[side])
 		return False
 
-	def just_remove(self, parent):
+	def block(self, parent, bit):
+		points = self.points
+		points.blocked[parent] |= bit
+		if self.retire_blocked is True and points.blocked[parent] == ALL_BLOCKED:
+			self.to_generate.remove(parent)
+			self.dead.append(parent)
+
+	def just_remove(self, parent, side):
 		return True
 
-	def generate_it(self):
-		while len(self.to_generate) > 0 and len(self.all_p) <= self.N:
-			g_idx = random.randint(0, len(self.to_generate)-1)
-			choice = self.get_choice()
-			point = self.to_generate[g_idx]
+	def generate_it(self, steps=-1):
+		# a negative steps runs until the frontier is empty or N is reached
+		metrics = self.metrics
+		while steps != 0 and len(self.to_generate) > 0 and len(self.points) <= self.N:
+			steps -= 1
+			u, choice, side = self.rng.step()
+			point = self.to_generate[int(u*len(self.to_generate))]
+			if metrics is not None:
+				metrics.count(STEP_COUNTERS[choice])
+				metrics.sample("frontier_size", len(self.to_generate))
 			if choice == 0:
-				ret = self.add_ball(point)
+				ret = self.add_ball(point, side)
 			elif choice == 1:
-				ret = self.add_node(point)
+				ret = self.add_node(point, side)
 			else:
-				ret = self.just_remove(point)
+				ret = self.just_remove(point, side)
 
 			if ret is True:
-				self.to_generate.pop(g_idx)
+				self.to_generate.remove(point)
 
 	def init_win(self, width, height, title):
-		if len(self.all_p) <= MAX_DRAW_CIRCLES + 2:
-			self.win = graphics.GraphWin(title, width, height)
+		if self.headless is True:
+			return
+		if len(self.points) <= MAX_DRAW_CIRCLES + 2:
+			self.win = load_graphics().GraphWin(title, width, height)
 			self.win.setBackground(background_color)
 		else:
-			print("too many circles, won't draw it, only save it to {}".format(eps_filename))
+			print("too many circles, won't draw it, only save it to {}".format(self.output_path(eps_filename)))
 
 	def win_draw_circle(self, x, y, r, color):
 		if self.win is not None:
@@ -365,7 +614,9 @@ class Simulator(object):
 		if self.win is not None:
 			self.win.postscript(file=filename, colormode="color")
 
-	def draw(self, title="test"):
+	def page_geometry(self):
+		# the size of the picture and how the points are scaled into it, a
+		# point is drawn at ((x-min_x+addition_bound)*x_scale, ...)
 		addition_bound = 2*max(self.r1, self.r2)
 		graph_height = self.max_y-self.min_y + 2*addition_bound
 		graph_width = self.max_x-self.min_x + 2*addition_bound
@@ -374,37 +625,63 @@ class Simulator(object):
 		if height > max_height:
 			width = width/height * max_height
 			height = max_height
+		return width, height, width/graph_width, height/graph_height, addition_bound
+
+	def page_columns(self, xs, ys, rs, point_scale):
+		# the columns scaled into the picture as page_geometry says, as lists,
+		# with numpy in one pass per column
+		width, height, x_scale, y_scale, addition_bound = self.page_geometry()
+		if numpy is None:
+			return ([(x-self.min_x+addition_bound)*x_scale for x in xs],
+				[(y-self.min_y+addition_bound)*y_scale for y in ys],
+				[r*point_scale for r in rs])
+		return (((numpy.array(xs, dtype=float)-self.min_x+addition_bound)*x_scale).tolist(),
+			((numpy.array(ys, dtype=float)-self.min_y+addition_bound)*y_scale).tolist(),
+			(numpy.array(rs, dtype=float)*point_scale).tolist())
+
+	def draw(self, title="test"):
+		width, height, x_scale, y_scale, addition_bound = self.page_geometry()
 		self.init_win(width, height, title)
-		self.ps_drawer = psdrawer.PsDrawer(eps_filename, width, height)
+		self.ps_drawer = psdrawer.PsDrawer(self.output_path(eps_filename), width, height)
 		self.ps_drawer.set_background(background_color)
-		x_scale = width/graph_width
-		y_scale = height/graph_height
 		point_scale = (x_scale+y_scale)/2
 		if draw_circles is True:
-			with CheckTime("draw circle time") as ct:
+			with CheckTime("draw circle time", self.metrics, self.profiler) as ct:
 				self.ps_drawer.change_color(circle_color)
-				for p in self.all_p:
-					r = p.r*point_scale
-					x = (p.x-self.min_x+addition_bound)*x_scale
-					y = (p.y-self.min_y+addition_bound)*y_scale
+				xs, ys, rs = self.page_columns(self.points.x, self.points.y, self.points.r, point_scale)
+				for x, y, r in zip(xs, ys, rs):
 					self.win_draw_circle(x, y, r, circle_color)
 					self.ps_drawer.draw_circle(x, y, r)
 
 		if draw_lines is True:
-			with CheckTime("draw line time") as ct:
+			with CheckTime("draw line time", self.metrics, self.profiler) as ct:
 				self.ps_drawer.change_color(line_color)
-				for line in self.lines:
-					x1 = (line.x1-self.min_x+addition_bound)*x_scale
-					x2 = (line.x2-self.min_x+addition_bound)*x_scale
-					y1 = (line.y1-self.min_y+addition_bound)*y_scale
-					y2 = (line.y2-self.min_y+addition_bound)*y_scale
-					weight = line_weight*(x_scale+y_scale)/2
+				xs, ys, _ = self.page_columns(self.points.x, self.points.y, (), point_scale)
+				weight = line_weight*(x_scale+y_scale)/2
+				for parent, child in self.points.edges():
+					x1, y1, x2, y2 = xs[parent], ys[parent], xs[child], ys[child]
 					self.win_draw_line(x1, y1, x2, y2, weight, line_color)
 					self.ps_drawer.draw_line(x1, y1, x2, y2, weight)
 
 		print("draw complete")
 		self.ps_drawer.close()
 
+	def output_path(self, filename):
+		return os.path.join(self.output_dir, filename)
+
+	def stream(self, batch_steps=10000):
+		# generate_it in chunks of batch_steps, yielding the ids of the points
+		# added by each chunk as soon as it is done, the points already there
+		# first
+		start = 0
+		while True:
+			if len(self.points) > start:
+				yield range(start, len(self.points))
+				start = len(self.points)
+			if len(self.to_generate) == 0 or len(self.points) > self.N:
+				break
+			self.generate_it(batch_steps)
+
 	def collect_data(self):
 		self.save_csv("x")
 		self.save_csv("y")
@@ -412,35 +689,45 @@ class Simulator(object):
 		self.save_lines()
 
 	def save_points(self):
-		endpoints = 0
-		nodes = 0
-		with open("points.csv", "wb") as fp:
-			points_info_list = list()
-			for p in self.all_p:
-				if p.is_endpoint is True:
-					endpoints += 1
-				if p.is_node is True:
-					nodes += 1
-				points_info_list.append("{},{},{},{},{}".format(p.x, p.y, p.r, p.n, p.idx))
-			write_list = ["{},{},{}".format(len(self.all_p), nodes, endpoints)] + points_info_list
+		points = self.points
+		endpoints = sum(points.is_endpoint)
+		nodes = sum(points.is_node)
+		with open(self.output_path("points.csv"), "w") as fp:
+			ns = directions(points.x, points.y, self.t)
+			points_info_list = ["{},{},{},{},{}".format(x, y, r, float(n), idx) for x, y, r, n, idx in zip(points.x, points.y, points.r, ns, points.tree)]
+			write_list = ["{},{},{}".format(len(points), nodes, endpoints)] + points_info_list
 			fp.write("\n".join(write_list))
 
 	def save_lines(self):
-		with open("lines.csv", "wb") as fp:
-			for line in self.lines:
-				fp.write("{}, {}, {}, {}\n".format(line.x1, line.y1, line.x2, line.y2))
+		xs, ys = self.points.x, self.points.y
+		with open(self.output_path("lines.csv"), "w") as fp:
+			for parent, child in self.points.edges():
+				fp.write("{}, {}, {}, {}\n".format(xs[parent], ys[parent], xs[child], ys[child]))
 		
 	def save_csv(self, axis_name):
-		x_list = sorted(self.all_p, key=lambda p: getattr(p, axis_name))
 		filename = "{name}N{name}.csv".format(name=axis_name)
 		min_v = getattr(self, "min_{}".format(axis_name))
 		max_v = getattr(self, "max_{}".format(axis_name))
-		with open(filename, "wb") as fp:
+		if numpy is not None:
+			# how many values are below every unit step, by bisecting the
+			# sorted column for all steps at once
+			steps = list()
+			while True:
+				steps.append(len(steps))
+				if steps[-1]+min_v > max_v:
+					break
+			x_list = numpy.sort(numpy.array(getattr(self.points, axis_name), dtype=float))
+			counts = numpy.searchsorted(x_list, [iter_v+min_v for iter_v in steps], side="left").tolist()
+			with open(self.output_path(filename), "w") as fp:
+				fp.write("".join("{},{}\n".format(iter_v, nv) for iter_v, nv in zip(steps, counts)))
+			return
+		x_list = sorted(getattr(self.points, axis_name))
+		with open(self.output_path(filename), "w") as fp:
 			nv = 0
 			p_idx = 0
 			iter_v = 0
 			while True:
-				while p_idx < len(x_list) and getattr(x_list[p_idx], axis_name) < iter_v+min_v:
+				while p_idx < len(x_list) and x_list[p_idx] < iter_v+min_v:
 					nv += 1
 					p_idx += 1
 				fp.write("{},{}\n".format(iter_v, nv))
@@ -449,26 +736,86 @@ class Simulator(object):
 				iter_v += 1
 
 
+def stream_sinks(s):
+	# the sinks writing the files collect_data and draw write
+	return [
+		sinks.PointsCsv(s.output_path("points.csv"), directions),
+		sinks.LinesCsv(s.output_path("lines.csv")),
+		sinks.AxisCsv("x"),
+		sinks.AxisCsv("y"),
+		sinks.Eps(s.output_path(eps_filename), background_color, circle_color, line_color, line_weight, draw_circles, draw_lines),
+	]
+
+def save_metrics(s):
+	if s.metrics is not None and metrics_file is not None:
+		s.metrics.dump(metrics_file)
+		print("metrics saved to {}".format(metrics_file))
+
+def save_profile(profiler):
+	if profiler is not None:
+		profiler.save()
+		print("profile saved to {}".format(profiler.output_dir))
+
 def check_generation():
+	print("import time: {} seconds".format(import_time))
+	resumed = resume is True and checkpoint_file is not None and os.path.exists(checkpoint_file)
+	profiler = profiling.Profiler(profile_dir, profile_cprofile) if profile_dir is not None else None
 	with CheckTime("init time") as ct:
-		s = Simulator(config, use_tree=tree_version)
+		if resumed:
+			s = checkpoint.load(Simulator, checkpoint_file)
+			print("resumed from {} with {} points".format(checkpoint_file, len(s.points)))
+		else:
+			s = Simulator(config, use_tree=tree_version, index_type=index_type, bucket_size=bucket_size, tight_bounds=tight_bounds, finger_search=finger_search, max_depth=max_depth, batch_check=batch_check, check_siblings=check_siblings, retire_blocked=retire_blocked, seed=seed, headless=headless, output_dir=output_dir, metrics=collect_metrics)
 		assert close_enough(s.p1+s.p2+s.p3, 1.0), "sum of 3 possibilities should be 1"
-	with CheckTime("generate time") as ct:
-		s.generate_first()
-		s.generate_it()
-	print(len(s.all_p))
+	print("seed: {}".format(s.rng.seed))
+	s.profiler = profiler
+	if streaming is True:
+		with CheckTime("generate and write time", s.metrics, profiler) as ct:
+			if not resumed:
+				s.generate_first()
+			if writer_threads is True:
+				pipeline.generate(s, stream_sinks(s))
+			else:
+				sinks.generate(s, stream_sinks(s))
+		print(len(s.points))
+		print(len(s.to_generate))
+		print(s.points.edge_count)
+		save_metrics(s)
+		save_profile(profiler)
+		return
+	# with profile_steps only those steps are profiled, in a section of their own
+	with CheckTime("generate time", s.metrics, profiler if profile_steps is None else None) as ct:
+		if not resumed:
+			s.generate_first()
+		if checkpoint_file is not None:
+			checkpoint.generate(s, checkpoint_file, checkpoint_interval)
+		elif parallel_workers > 1:
+			parallel.generate(s, parallel_workers)
+		elif profile_steps is not None:
+			first, last = profile_steps
+			s.generate_it(first)
+			print("profiling steps {} to {} from {} points".format(first, last, len(s.points)))
+			with CheckTime("generate steps time", s.metrics, profiler) as ct:
+				s.generate_it(last-first)
+			s.generate_it()
+		else:
+			s.generate_it()
+	print(len(s.points))
 	print(len(s.to_generate))
-	print(len(s.lines))
+	print(s.points.edge_count)
 	print(s.max_x)
 	print(s.min_x)
 	print(s.max_y)
 	print(s.min_y)
-	s.collect_data()
-	with CheckTime("draw time") as ct:
+	with CheckTime("collect data time", s.metrics, profiler) as ct:
+		s.collect_data()
+	with CheckTime("draw time", s.metrics, profiler) as ct:
 		s.draw("test")
+	save_metrics(s)
+	save_profile(profiler)
 	if s.win:
 		s.win.getMouse()
-		a = raw_input("press any key to shutdown")
+		a = input("press any key to shutdown")
 
 def test():
 	start = time.time()
@@ -479,5 +826,38 @@ def test():
 	print(leaf)
 
 if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--headless", action="store_true", help="do not open a window or import graphics, only write the eps and csv files")
+	parser.add_argument("--workers", type=int, default=parallel_workers, help="split the generation over this many processes")
+	parser.add_argument("--stream", action="store_true", help="write the output files while generating, implies --headless")
+	parser.add_argument("--pipeline", action="store_true", help="like --stream, with the output written on background threads")
+	parser.add_argument("--metrics", default=metrics_file, metavar="FILE", help="collect counters, histograms and timers of the run and save them to FILE as json")
+	parser.add_argument("--profile", default=profile_dir, metavar="DIR", help="profile generation, collect_data and drawing, saving pstats and collapsed stacks to DIR")
+	parser.add_argument("--profile-steps", metavar="START:STOP", help="with --profile, profile only these steps of generate_it")
+	parser.add_argument("--no-cprofile", action="store_true", help="with --profile, only sample stacks, without the cProfile overhead")
+	parser.add_argument("--checkpoint", default=checkpoint_file, metavar="FILE", help="save the generation to FILE every --checkpoint-interval seconds")
+	parser.add_argument("--checkpoint-interval", type=float, default=checkpoint_interval)
+	parser.add_argument("--resume", action="store_true", help="continue from the --checkpoint file when it exists")
+	args = parser.parse_args()
+	if args.headless or args.stream or args.pipeline:
+		headless = True
+	if args.stream or args.pipeline:
+		streaming = True
+	if args.pipeline:
+		writer_threads = True
+	parallel_workers = args.workers
+	if args.metrics is not None:
+		collect_metrics = True
+		metrics_file = args.metrics
+	profile_dir = args.profile
+	if args.profile_steps is not None:
+		first, last = args.profile_steps.split(":")
+		profile_steps = (int(first), int(last))
+	if args.no_cprofile:
+		profile_cprofile = False
+	checkpoint_file = args.checkpoint
+	checkpoint_interval = args.checkpoint_interval
+	resume = resume or args.resume
 	check_generation()
 	#test()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+import json
+import time
+
+# what a run did, for comparing configs with numbers. a Simulator made with
+# metrics=True has a Metrics in s.metrics and hands it to its spatial index,
+# otherwise both hold None and every instrumented spot costs one "is not None"
+# test. names are dotted, "index.nodes_visited", timers nest: a timer started
+# while another one runs is kept under it
+
+class Histogram(object):
+	# count, sum, min and max of the values and how many fall in power of two
+	# buckets: bucket k holds the values in [2**(k-1), 2**k), bucket 0 those
+	# below 1
+	def __init__(self):
+		self.count = 0
+		self.total = 0
+		self.min = float("inf")
+		self.max = float("-inf")
+		self.buckets = dict()
+
+	def add(self, value):
+		self.count += 1
+		self.total += value
+		if value < self.min:
+			self.min = value
+		if value > self.max:
+			self.max = value
+		k = int(value).bit_length() if value >= 1 else 0
+		self.buckets[k] = self.buckets.get(k, 0)+1
+
+	def as_dict(self):
+		return {
+			"count": self.count,
+			"sum": self.total,
+			"mean": self.total/self.count if self.count > 0 else None,
+			"min": self.min if self.count > 0 else None,
+			"max": self.max if self.count > 0 else None,
+			# [lower bound, upper bound, count]
+			"buckets": [[(1 << k-1) if k > 0 else 0, 1 << k, n] for k, n in sorted(self.buckets.items())],
+		}
+
+class Timer(object):
+	def __init__(self, metrics, name):
+		self.metrics = metrics
+		self.name = name
+
+	def __enter__(self):
+		self.metrics.start(self.name)
+		return self
+
+	def __exit__(self, exc_type, exc_value, exc_tb):
+		self.metrics.stop()
+
+class Metrics(object):
+	def __init__(self):
+		self.counters = dict()
+		self.histograms = dict()
+		# path of timer names -> [calls, seconds]
+		self.timers = dict()
+		self.running = list()
+
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0)+n
+
+	def sample(self, name, value):
+		histogram = self.histograms.get(name)
+		if histogram is None:
+			histogram = Histogram()
+			self.histograms[name] = histogram
+		histogram.add(value)
+
+	def counted(self, name, fn):
+		# fn counting its calls under name
+		counters = self.counters
+		def wrapper(*args):
+			counters[name] = counters.get(name, 0)+1
+			return fn(*args)
+		return wrapper
+
+	def start(self, name):
+		path = self.running[-1][0]+(name,) if self.running else (name,)
+		self.running.append((path, time.time()))
+
+	def stop(self):
+		# the seconds since the matching start
+		path, start = self.running.pop()
+		seconds = time.time()-start
+		timer = self.timers.get(path)
+		if timer is None:
+			timer = [0, 0.0]
+			self.timers[path] = timer
+		timer[0] += 1
+		timer[1] += seconds
+		return seconds
+
+	def timer(self, name):
+		return Timer(self, name)
+
+	def timer_tree(self):
+		# {name: {"calls", "seconds", "children": {...}}}
+		root = dict()
+		for path in sorted(self.timers):
+			level = root
+			for name in path[:-1]:
+				level = level.setdefault(name, {"calls": 0, "seconds": 0.0}).setdefault("children", dict())
+			calls, seconds = self.timers[path]
+			level.setdefault(path[-1], dict()).update(calls=calls, seconds=seconds)
+		return root
+
+	def as_dict(self):
+		return {
+			"timers": self.timer_tree(),
+			"counters": dict(self.counters),
+			"histograms": dict((name, h.as_dict()) for name, h in self.histograms.items()),
+		}
+
+	def dump(self, filename):
+		with open(filename, "w") as fp:
+			json.dump(self.as_dict(), fp, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+	# what collecting costs: the same run with and without metrics
+	import sys
+	import main
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	conf = dict(main.config, N=n)
+	for enabled in (False, True):
+		s = main.Simulator(conf, seed=1, headless=True, metrics=enabled)
+		s.generate_first()
+		start = time.time()
+		s.generate_it()
+		print("metrics={}: {:.3f} seconds for {} points".format(enabled, time.time()-start, len(s.points)))
+	print(json.dumps(s.metrics.as_dict(), indent=2, sort_keys=True))
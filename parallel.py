@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+from array import array
+from bisect import bisect_right
+import multiprocessing
+
+import frontier
+import rng
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# generate_it of one Simulator split over worker processes. the plane is cut
+# into vertical strips, one per worker. a worker holds every point inside its
+# strip and the frontier points of the strip interior, those at least
+# margin = R+reach away from the strip edges. it grows them in epochs: all
+# its candidates are R away from the edges, so every check it does only looks
+# at points of its own strip, and no other process adds points there in the
+# meantime. the frontier points closer to a cut than margin (the edge zones)
+# belong to the main process, which grows them between two epochs. their
+# checks look at most 2*margin away from a cut, so the main process only
+# indexes the points in these halo bands, it keeps the other points of the
+# workers in s.points without indexing them. the points it adds are sent to
+# the workers owning them at the start of the next epoch (the halo exchange).
+# every placement is thus checked against the same points as in a serial run,
+# so trees still never cross.
+#
+# the statistics are not exactly those of generate_it: in an epoch every strip
+# takes a number of steps proportional to its frontier, and the edge zones
+# are grown afterwards in one serial pass. each step still picks uniformly
+# from the frontier it runs on and branches with p1/p2/p3, only the
+# interleaving of the steps differs. a seed reproduces a run for the same
+# number of workers only.
+#
+# when generation stops at N, s.quadtree only holds the points of the halo
+# bands, s.reindex() builds the full index
+
+# the main process grows the pattern alone until it has this many points
+WARMUP_POINTS = 5000
+# steps of an epoch per frontier point at its start
+EPOCH_STEPS = 8.0
+# generation goes back to serial when the frontier is smaller than this per worker
+MIN_FRONTIER = 50
+# the strips are cut again every time the number of points grew by this factor
+REPARTITION_GROWTH = 2.0
+
+def check_distance(s):
+	# the largest distance check_position looks at
+	return max(s.d, s.a, s.b, s.c, s.e)
+
+def reach(s):
+	# the farthest a candidate gets from the frontier point it grows from
+	return max(s.c, s.a+s.b)
+
+# what a worker needs of a point
+COLUMNS = ("x", "y", "r", "ux", "uy", "tree", "is_node")
+
+def columns(points, ids):
+	return tuple(array(c.typecode, [c[p] for p in ids]) for c in (getattr(points, name) for name in COLUMNS))
+
+def column_slices(points, first, stop):
+	# columns of the points first, ..., stop-1
+	return tuple(getattr(points, name)[first:stop] for name in COLUMNS)
+
+def intervals(cuts, distance):
+	# the edges of [cut-distance, cut+distance) around the sorted cuts, which
+	# are at least 2*distance apart. x is in one of these intervals when
+	# bisect_right(edges, x) is odd
+	edges = list()
+	for c in cuts:
+		edges.extend((c-distance, c+distance))
+	return edges
+
+class ZoneFrontier(frontier.Frontier):
+	# a frontier taking only the points whose x passes inside(x), the others
+	# are put in handoff for the process growing them
+	def __init__(self, xs, inside):
+		frontier.Frontier.__init__(self)
+		self.xs = xs
+		self.inside = inside
+		self.handoff = array("i")
+
+	def append(self, pid):
+		if self.inside(self.xs[pid]):
+			frontier.Frontier.append(self, pid)
+		else:
+			self.handoff.append(pid)
+
+class RegionWorker(object):
+	# a Simulator holding the points of one strip, run in a worker process.
+	# global_ids maps its point ids to those of the main process. the points
+	# it adds in an epoch get their global ids in the next message, which
+	# carries the id merge gave the first of them, until then they are sent
+	# as -2, -3, ...
+	def __init__(self, cls, conf, options, margin):
+		self.s = cls(conf, **dict(options, headless=True))
+		self.s.to_generate = ZoneFrontier(self.s.points.x, lambda x: False)
+		self.margin = margin
+		self.global_ids = array("i")
+		self.local = dict()
+		self.pending = 0
+
+	def assign(self, base):
+		if self.pending > 0:
+			ids = range(base, base+self.pending)
+			for pid, gid in enumerate(ids, len(self.global_ids)):
+				self.local[gid] = pid
+			self.global_ids.extend(ids)
+			self.pending = 0
+
+	def add(self, cols, ids):
+		# the points ids it does not hold yet, parents do not matter for the checks
+		local = self.local
+		keep = [k for k, gid in enumerate(ids) if gid not in local]
+		if len(keep) < len(ids):
+			cols = tuple(array(c.typecode, [c[k] for k in keep]) for c in cols)
+			ids = [ids[k] for k in keep]
+		x, y, r, ux, uy, tree, is_node = cols
+		pids = self.s.add_points(x, y, r, ux, uy, tree, array("i", [-1])*len(x), is_node)
+		for pid, gid in zip(pids, ids):
+			local[gid] = pid
+		self.global_ids.extend(ids)
+		self.s.insert_list_to_quadtree(pids)
+
+	def push(self, todo, blocked):
+		points = self.s.points
+		for gid, bits in zip(todo, blocked):
+			pid = self.local[gid]
+			points.blocked[pid] = bits
+			self.s.to_generate.append(pid)
+
+	def partition(self, base, lo, hi, cols, ids, todo, blocked):
+		# a new strip [lo, hi): the points of it it misses and its interior frontier
+		self.assign(base)
+		self.add(cols, ids)
+		lo += self.margin
+		hi -= self.margin
+		self.s.to_generate = ZoneFrontier(self.s.points.x, lambda x: lo <= x < hi)
+		self.push(todo, blocked)
+
+	def collect(self, base):
+		# hand the frontier back: its global ids and blocked bits
+		self.assign(base)
+		s = self.s
+		todo = array("i", [self.global_ids[p] for p in s.to_generate])
+		blocked = array("B", [s.points.blocked[p] for p in s.to_generate])
+		s.to_generate = ZoneFrontier(s.points.x, lambda x: False)
+		return todo, blocked
+
+	def epoch(self, base, cols, ids, todo, blocked, steps, cap, seed):
+		self.assign(base)
+		self.add(cols, ids)
+		self.push(todo, blocked)
+		s = self.s
+		points = s.points
+		s.to_generate.handoff = array("i")
+		s.dead = array("i")
+		s.rng = rng.BlockRandom(seed, (s.p1, s.p2, s.p3))
+		first = len(points)
+		s.N = first+cap-1
+		s.generate_it(steps)
+		self.pending = len(points)-first
+
+		global_ids = self.global_ids
+		def code(pid):
+			if pid < first:
+				return global_ids[pid]
+			return first-pid-2
+		cols = (array("i", [code(p) for p in points.parent[first:]]),)+column_slices(points, first, len(points))
+		return (
+			cols,
+			array("i", [code(p) for p in s.to_generate.handoff]),
+			array("i", [code(p) for p in s.dead]),
+			len(s.to_generate),
+		)
+
+def worker_main(conn, cls, conf, options, margin):
+	worker = RegionWorker(cls, conf, options, margin)
+	while True:
+		message = conn.recv()
+		if message[0] == "stop":
+			break
+		conn.send(getattr(worker, message[0])(*message[1:]))
+	conn.close()
+
+def cut(xs, strips, margin):
+	# cut points splitting xs into about equal strips, fewer when two cuts
+	# would leave no room for interior points between them
+	xs = sorted(xs)
+	ret = list()
+	if not xs:
+		return ret
+	for k in range(1, strips):
+		x = xs[len(xs)*k//strips]
+		if not ret or x-ret[-1] >= 4*margin:
+			ret.append(x)
+	return ret
+
+class Strips(object):
+	# the main process side: s with all points, the workers and the edge zones
+	def __init__(self, s, conns, margin):
+		self.s = s
+		self.conns = conns
+		self.margin = margin
+		self.cuts = None
+		# the strip of worker i is [bounds[i], bounds[i+1])
+		self.bounds = None
+		# ids merge gave the last points of every worker
+		self.bases = [0]*len(conns)
+		# frontier size of every worker
+		self.sizes = [0]*len(conns)
+		# whether a point is in s.quadtree, points before the first
+		# partition all are
+		self.indexed = bytearray(b"\x01")*len(s.points)
+		self.edge = None
+		# points the main process added and their frontier points in strip
+		# interiors, waiting for the next epoch
+		self.unsynced = len(s.points)
+		self.sync = None
+		self.todo = None
+
+	def strip(self, x):
+		return bisect_right(self.cuts, x)
+
+	def index(self, pids):
+		# add the new points pids in the halo bands to s.quadtree
+		s = self.s
+		xs = s.points.x
+		band = self.band
+		indexed = self.indexed
+		indexed.extend(bytearray(len(s.points)-len(indexed)))
+		add = [p for p in pids if bisect_right(band, xs[p]) & 1]
+		for p in add:
+			indexed[p] = 1
+		s.insert_list_to_quadtree(add)
+
+	def collect(self):
+		# every frontier point back in s, with its blocked bits
+		s = self.s
+		todo = list()
+		if self.edge is not None:
+			todo.extend(self.edge)
+			for lst in self.todo:
+				todo.extend(lst)
+			for i in range(len(self.cuts)+1):
+				self.conns[i].send(("collect", self.bases[i]))
+			for i in range(len(self.cuts)+1):
+				gids, blocked = self.conns[i].recv()
+				for gid, bits in zip(gids, blocked):
+					s.points.blocked[gid] = bits
+				todo.extend(gids)
+		else:
+			todo.extend(s.to_generate)
+		return todo
+
+	def partition(self):
+		s = self.s
+		points = s.points
+		xs = points.x
+		todo = self.collect()
+		old_cuts = self.cuts
+		self.cuts = cut([xs[p] for p in todo], len(self.conns), self.margin)
+		strips = len(self.cuts)+1
+		self.bounds = [float("-inf")]+self.cuts+[float("inf")]
+		# the halo bands and the edge zones
+		self.band = intervals(self.cuts, 2*self.margin)
+		zone = intervals(self.cuts, self.margin)
+
+		# a worker keeps the points of its old strip, it gets those that
+		# changed strip and the ones the main process added since the last
+		# epoch. it skips points it already holds. the points in the new halo
+		# bands are indexed
+		cuts = self.cuts
+		band = self.band
+		indexed = self.indexed
+		indexed.extend(bytearray(len(points)-len(indexed)))
+		if numpy is None:
+			send = [list() for i in range(strips)]
+			add = list()
+			for p in range(len(points)):
+				x = xs[p]
+				i = bisect_right(cuts, x)
+				if old_cuts is None or p >= self.unsynced or bisect_right(old_cuts, x) != i:
+					send[i].append(p)
+				if not indexed[p] and bisect_right(band, x) & 1:
+					add.append(p)
+		else:
+			x = numpy.array(xs, dtype=float)
+			owner = numpy.searchsorted(cuts, x, side="right")
+			if old_cuts is None:
+				moved = numpy.ones(len(x), dtype=bool)
+			else:
+				moved = owner != numpy.searchsorted(old_cuts, x, side="right")
+			moved[self.unsynced:] = True
+			send = [numpy.flatnonzero(moved & (owner == i)).tolist() for i in range(strips)]
+			in_band = (numpy.searchsorted(band, x, side="right") & 1).astype(bool)
+			add = numpy.flatnonzero(in_band & (numpy.array(indexed, dtype=numpy.uint8) == 0)).tolist()
+		for p in add:
+			indexed[p] = 1
+		s.insert_list_to_quadtree(add)
+
+		self.edge = ZoneFrontier(xs, lambda x: bisect_right(zone, x) & 1)
+		grow = [list() for i in range(strips)]
+		for p in todo:
+			x = xs[p]
+			if bisect_right(zone, x) & 1:
+				self.edge.append(p)
+			else:
+				grow[bisect_right(cuts, x)].append(p)
+		for i in range(strips):
+			blocked = array("B", [points.blocked[p] for p in grow[i]])
+			self.conns[i].send(("partition", self.bases[i], self.bounds[i], self.bounds[i+1], columns(points, send[i]), array("i", send[i]), array("i", grow[i]), blocked))
+		for i in range(strips):
+			self.conns[i].recv()
+			self.sizes[i] = len(grow[i])
+		self.unsynced = len(points)
+		self.sync = [list() for i in range(strips)]
+		self.todo = [list() for i in range(strips)]
+
+	def frontier_size(self):
+		return len(self.edge)+sum(self.sizes[:len(self.cuts)+1])+sum(len(t) for t in self.todo)
+
+	def merge(self, i, result):
+		# add what worker i did in an epoch to s
+		s = self.s
+		cols, handoff, dead, size = result
+		points = s.points
+		base = len(points)
+		parents, x, y, r, ux, uy, tree, is_node = cols
+		parents = array("i", [p if p >= 0 else base-p-2 for p in parents])
+		pids = s.add_points(x, y, r, ux, uy, tree, parents, is_node)
+		is_endpoint = points.is_endpoint
+		for parent in parents:
+			is_endpoint[parent] = False
+		for pid, node in zip(pids, is_node):
+			if node:
+				is_endpoint[pid] = False
+		self.index(pids)
+		self.edge.extend(c if c >= 0 else base-c-2 for c in handoff)
+		s.dead.extend(c if c >= 0 else base-c-2 for c in dead)
+		self.bases[i] = base
+		self.sizes[i] = size
+
+	def epoch(self):
+		s = self.s
+		points = s.points
+		strips = len(self.cuts)+1
+		total = self.frontier_size()
+		remaining = s.N+1-len(points)
+		for i in range(strips):
+			todo = self.todo[i]
+			size = self.sizes[i]+len(todo)
+			steps = int(round(EPOCH_STEPS*size))
+			cap = int(remaining*size/total)
+			seed = int(s.rng.random()*(1 << 32))
+			blocked = array("B", [points.blocked[p] for p in todo])
+			sync = self.sync[i]
+			self.conns[i].send(("epoch", self.bases[i], columns(points, sync), array("i", sync), array("i", todo), blocked, steps, cap, seed))
+		for i in range(strips):
+			self.merge(i, self.conns[i].recv())
+
+		# the serial pass over the edge zones
+		first = len(points)
+		s.to_generate = self.edge
+		self.edge.handoff = array("i")
+		s.generate_it(int(round(EPOCH_STEPS*len(self.edge))))
+		xs = points.x
+		self.indexed.extend(b"\x01"*(len(points)-len(self.indexed)))
+		self.sync = [list() for i in range(strips)]
+		for p in range(first, len(points)):
+			self.sync[self.strip(xs[p])].append(p)
+		self.todo = [list() for i in range(strips)]
+		for p in self.edge.handoff:
+			self.todo[self.strip(xs[p])].append(p)
+		self.unsynced = first
+
+	def finish(self):
+		# the frontier back in s, and the full index when generation goes on
+		s = self.s
+		todo = self.collect()
+		s.to_generate = frontier.Frontier()
+		s.to_generate.extend(todo)
+		if len(s.to_generate) > 0 and len(s.points) <= s.N:
+			indexed = self.indexed
+			indexed.extend(bytearray(len(s.points)-len(indexed)))
+			s.insert_list_to_quadtree([p for p in range(len(s.points)) if not indexed[p]])
+
+def generate(s, processes):
+	# s.generate_it() on processes workers, s must have its seeds placed
+	R = check_distance(s)
+	# a little slack against rounding in the candidate placement
+	margin = (R+reach(s))*(1+1e-9)
+	N = s.N
+	s.N = min(N, WARMUP_POINTS)
+	s.generate_it()
+	s.N = N
+	if len(s.to_generate) < MIN_FRONTIER*processes:
+		s.generate_it()
+		return
+
+	conns = list()
+	workers = list()
+	for i in range(processes):
+		conn, child = multiprocessing.Pipe()
+		p = multiprocessing.Process(target=worker_main, args=(child, type(s), s.conf, s.options, margin))
+		p.daemon = True
+		p.start()
+		conns.append(conn)
+		workers.append(p)
+	strips = Strips(s, conns, margin)
+	try:
+		partitioned = 0
+		while True:
+			if partitioned == 0 or len(s.points) >= REPARTITION_GROWTH*partitioned:
+				strips.partition()
+				partitioned = len(s.points)
+			if strips.frontier_size() < MIN_FRONTIER*processes or len(s.points) > s.N:
+				break
+			strips.epoch()
+		strips.finish()
+	finally:
+		for conn in conns:
+			conn.send(("stop",))
+		for p in workers:
+			p.join()
+	s.generate_it()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+import sys
+import threading
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+import sinks
+
+# batches a writer may fall behind before generate_it waits for it
+QUEUE_SIZE = 8
+
+class Writer(threading.Thread):
+	# runs one sink on its own thread, fed with batches through a bounded
+	# queue. None closes the sink and ends the thread. after an error the
+	# writer keeps taking batches, so the generating thread never blocks on
+	# it, and generate raises the error at the end
+	def __init__(self, s, sink, queue_size=QUEUE_SIZE):
+		threading.Thread.__init__(self, name="writer-{}".format(type(sink).__name__))
+		self.daemon = True
+		self.s = s
+		self.sink = sink
+		self.queue = queue.Queue(queue_size)
+		self.error = None
+
+	def run(self):
+		while True:
+			pids = self.queue.get()
+			if pids is None:
+				break
+			if self.error is None:
+				try:
+					self.sink.write(self.s, pids)
+				except Exception:
+					self.error = sys.exc_info()[1]
+		if self.error is None:
+			try:
+				self.sink.close(self.s)
+			except Exception:
+				self.error = sys.exc_info()[1]
+
+def generate(s, sink_list, batch_steps=sinks.BATCH_STEPS, queue_size=QUEUE_SIZE):
+	# sinks.generate with every sink on a writer thread. the points of a
+	# batch never change once added, so the writers read them from s while
+	# it keeps growing. the sinks are closed when generation ends, also when
+	# it ends with an error
+	for sink in sink_list:
+		sink.open(s)
+	writers = [Writer(s, sink, queue_size) for sink in sink_list]
+	for writer in writers:
+		writer.start()
+	try:
+		for pids in s.stream(batch_steps):
+			for writer in writers:
+				writer.queue.put(pids)
+			if any(writer.error is not None for writer in writers):
+				break
+	finally:
+		for writer in writers:
+			writer.queue.put(None)
+		for writer in writers:
+			writer.join()
+	for writer in writers:
+		if writer.error is not None:
+			raise writer.error
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+from array import array
+
+class PointStore(object):
+	# columnar storage of the generated points, a point is just its index
+	# into the columns. (ux, uy) is the unit growth direction, computed once
+	# when the point is added. parent is -1 for the first point of every tree.
+	# blocked is a bit mask of the placements found blocked around the point
+	def __init__(self):
+		self.x = array("d")
+		self.y = array("d")
+		self.r = array("d")
+		self.ux = array("d")
+		self.uy = array("d")
+		self.tree = array("i")
+		self.parent = array("i")
+		self.is_node = array("b")
+		self.is_endpoint = array("b")
+		self.blocked = array("B")
+
+	def __len__(self):
+		return len(self.x)
+
+	column_names = ("x", "y", "r", "ux", "uy", "tree", "parent", "is_node", "is_endpoint", "blocked")
+
+	@property
+	def columns(self):
+		return tuple(getattr(self, name) for name in self.column_names)
+
+	def add(self, x, y, r, ux, uy, tree, parent=-1, is_node=False):
+		pid = len(self.x)
+		self.x.append(x)
+		self.y.append(y)
+		self.r.append(r)
+		self.ux.append(ux)
+		self.uy.append(uy)
+		self.tree.append(tree)
+		self.parent.append(parent)
+		self.is_node.append(is_node)
+		self.is_endpoint.append(True)
+		self.blocked.append(0)
+		return pid
+
+	def extend(self, x, y, r, ux, uy, tree, parent, is_node):
+		# add many points at once from columns of equal length, their ids
+		# follow on from the last point
+		first = len(self.x)
+		n = len(x)
+		self.x.extend(x)
+		self.y.extend(y)
+		self.r.extend(r)
+		self.ux.extend(ux)
+		self.uy.extend(uy)
+		self.tree.extend(tree)
+		self.parent.extend(parent)
+		self.is_node.extend(is_node)
+		self.is_endpoint.extend([True]*n)
+		self.blocked.extend([0]*n)
+		return range(first, first+n)
+
+	# every point but the first of a tree is the child end of exactly one
+	# edge, so edges are read from the parent column instead of being stored
+	@property
+	def edge_count(self):
+		return len(self.parent)-self.parent.count(-1)
+
+	def edges(self):
+		# (parent, child) in the order the children were added
+		for child, parent in enumerate(self.parent):
+			if parent >= 0:
+				yield parent, child
+
+	def edge_array(self):
+		# the edges flattened to parent0, child0, parent1, child1, ...
+		ret = array("i")
+		for edge in self.edges():
+			ret.extend(edge)
+		return ret
+
+	def nbytes(self):
+		return sum(c.itemsize*len(c) for c in self.columns)
+
+	def __repr__(self):
+		return "PointStore<points={}>".format(len(self))
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+import os
+import signal
+
+try:
+	import cProfile as profile
+except ImportError:
+	import profile
+
+# profiles of the sections of a run, each section gets a NAME.pstats from
+# cProfile and a NAME.collapsed of sampled stacks, one "frame;frame;... count"
+# line per stack as flamegraph.pl and speedscope read them. sections nest like
+# the CheckTime blocks they come from: while an inner section runs the outer
+# one is paused, so every moment is counted in one section only.
+# the stacks are sampled with a SIGPROF timer in cpu time, which only exists
+# on unix and only sees the main thread. cProfile makes every python call
+# slower, which also skews the samples towards code making many calls, so it
+# can be left off to get the stacks alone. the sampler's own calls show up in
+# the pstats as sample and add_stack
+
+# cpu seconds between two stack samples
+SAMPLE_INTERVAL = 0.002
+
+def frame_name(frame):
+	code = frame.f_code
+	return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+def file_name(section):
+	# "draw circle time" -> "draw_circle"
+	if section.endswith(" time"):
+		section = section[:-len(" time")]
+	return section.replace(" ", "_")
+
+class Section(object):
+	def __init__(self, use_cprofile):
+		self.profile = profile.Profile() if use_cprofile is True else None
+		self.stacks = dict()
+		self.samples = 0
+
+	def resume(self):
+		if self.profile is not None:
+			self.profile.enable()
+
+	def pause(self):
+		if self.profile is not None:
+			self.profile.disable()
+
+	def add_stack(self, frame):
+		names = list()
+		while frame is not None:
+			names.append(frame_name(frame))
+			frame = frame.f_back
+		stack = ";".join(reversed(names))
+		self.stacks[stack] = self.stacks.get(stack, 0)+1
+		self.samples += 1
+
+class Profiler(object):
+	def __init__(self, output_dir, use_cprofile=True, interval=SAMPLE_INTERVAL):
+		self.output_dir = output_dir
+		self.use_cprofile = use_cprofile
+		self.interval = interval
+		self.can_sample = hasattr(signal, "setitimer") and hasattr(signal, "SIGPROF")
+		self.sections = dict()
+		self.order = list()
+		self.running = list()
+		self.old_handler = None
+
+	def start(self, name):
+		if self.running:
+			self.running[-1].pause()
+		else:
+			self.start_sampling()
+		section = self.sections.get(name)
+		if section is None:
+			section = Section(self.use_cprofile)
+			self.sections[name] = section
+			self.order.append(name)
+		self.running.append(section)
+		section.resume()
+
+	def stop(self):
+		self.running.pop().pause()
+		if self.running:
+			self.running[-1].resume()
+		else:
+			self.stop_sampling()
+
+	def start_sampling(self):
+		if self.can_sample:
+			self.old_handler = signal.signal(signal.SIGPROF, self.sample)
+			signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+	def stop_sampling(self):
+		if self.can_sample:
+			signal.setitimer(signal.ITIMER_PROF, 0, 0)
+			signal.signal(signal.SIGPROF, self.old_handler)
+
+	def sample(self, signum, frame):
+		if self.running:
+			self.running[-1].add_stack(frame)
+
+	def save(self):
+		# the files of every section, returns their paths
+		if not os.path.isdir(self.output_dir):
+			os.makedirs(self.output_dir)
+		paths = list()
+		for name in self.order:
+			section = self.sections[name]
+			base = os.path.join(self.output_dir, file_name(name))
+			if section.profile is not None:
+				section.profile.dump_stats(base+".pstats")
+				paths.append(base+".pstats")
+			if self.can_sample:
+				with open(base+".collapsed", "w") as fp:
+					for stack, count in sorted(section.stacks.items()):
+						fp.write("{} {}\n".format(stack, count))
+				paths.append(base+".collapsed")
+			print("profile {}: {} samples".format(name, section.samples))
+		if not self.can_sample:
+			print("no SIGPROF timer on this platform, stacks were not sampled")
+		return paths
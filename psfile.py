@@ -29,7 +29,12 @@ Exported classes:
     PSFile - Stand-alone PostScript files
 """
 
-import time, StringIO
+import time, tempfile, shutil
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
 
 __version__ = '0.9'
 __all__ = [ 'EPSFile', 'PSFile', 'paper_sizes' ]
@@ -59,7 +64,8 @@ class PSBase(object):
 
         self.definitions = []
         self.dict_space = 0     # extra space in the dictionary
-        self.body = StringIO.StringIO()
+        # the body can get large, it is kept in a temporary file until close
+        self.body = tempfile.TemporaryFile(mode="w+")
 
         self.closed = False
 
@@ -105,7 +111,7 @@ class PSBase(object):
         fd.flush()
 
     def _decode_paper_size(self, paper):
-        if isinstance(paper, basestring) and paper.endswith("*"):
+        if isinstance(paper, string_types) and paper.endswith("*"):
             flip = True
             paper = paper[:-1]
         else:
@@ -244,7 +250,8 @@ class PSBase(object):
                 fd.write("/%s { %s } bind def\n"%(name, body.strip()))
 
     def _write_body(self):
-        self.fd.write(self.body.getvalue())
+        self.body.seek(0)
+        shutil.copyfileobj(self.body, self.fd)
         self.fd.write("showpage\n")
 
     def _write_trailer(self):
@@ -320,7 +327,7 @@ class PSFile(PSBase):
 
         w = self.paper_width
         h = self.paper_height
-        for name, dim in paper_sizes.iteritems():
+        for name, dim in paper_sizes.items():
             if dim == (w,h):
                 paper = name
                 orientation = "Portrait"
@@ -350,7 +357,8 @@ class PSFile(PSBase):
         fd = self.fd
         fd.write("%%Page: 1 1\n")
         fd.write("/pgsave save def\n")
-        fd.write(self.body.getvalue())
+        self.body.seek(0)
+        shutil.copyfileobj(self.body, fd)
         fd.write("pgsave restore\n")
         fd.write("showpage\n")
 
@@ -2,19 +2,41 @@
 
 from __future__ import division, print_function
 from collections import deque
+from array import array
 
 MAX_DEPTH = 10
+# bucket mode only creates the cells it needs, so it can afford to go deeper
+BUCKET_MAX_DEPTH = 24
+# resolution of the Z-order keys used by extend_items, per axis
+MORTON_SIDE = 1 << 16
+
+def spread_bits(v):
+	# 16 bit v -> bit i moved to bit 2*i
+	v = (v | (v << 8)) & 0x00FF00FF
+	v = (v | (v << 4)) & 0x0F0F0F0F
+	v = (v | (v << 2)) & 0x33333333
+	v = (v | (v << 1)) & 0x55555555
+	return v
 
 class Node(object):
-	def __init__(self, x, y, width, height, depth, min_size):
+	# items are point ids of a pointstore.PointStore, the root keeps the store
+	# in self.points to look up their coordinates
+	# a metrics.Metrics set on the root counts its queries and visited nodes
+	metrics = None
+
+	def __init__(self, x, y, width, height, depth, min_size, points=None):
 		self.x = x
 		self.y = y
 		self.width = width
 		self.height = height
 		self.depth = depth
 		self.min_size = min_size
+		self.points = points
+		self.parent = None
 		self.children = list()
 		self.items = list()
+		# [min_x, min_y, max_x, max_y] of items, only kept by trees with tight_bounds
+		self.item_bounds = None
 
 	@property
 	def is_leaf(self):
@@ -37,6 +59,10 @@ class Node(object):
 			return False
 		if self.children:
 			return True
+		self.spawn_children()
+		return True
+
+	def spawn_children(self):
 		children_width = self.width/2
 		children_height = self.height/2
 		self.children.extend([
@@ -45,7 +71,8 @@ class Node(object):
 			Node(self.x, self.y+children_height, children_width, children_height, self.depth+1, self.min_size),
 			Node(self.x+children_width, self.y+children_height, children_width, children_height, self.depth+1, self.min_size)
 		])
-		return True
+		for child in self.children:
+			child.parent = self
 
 	def loop_generate(self):
 		# change list to deque, now the performance is almost same as recursive_generate
@@ -75,8 +102,70 @@ class Node(object):
 	def intersect(self, x, y):
 		return self.x <= x < self.upper_x and self.y <= y < self.upper_y
 
+	def contains_circle(self, x, y, r):
+		return self.x <= x-r and x+r < self.upper_x and self.y <= y-r and y+r < self.upper_y
+
+	def climb(self, hint, x, y, r):
+		# walk up from the hint node (any node of this tree, e.g. the last leaf
+		# used) to the first ancestor holding the whole circle, the root at
+		# worst. siblings are reached through the parent link, the caller then
+		# descends from the returned node
+		node = hint
+		while node.parent is not None and not node.contains_circle(x, y, r):
+			node = node.parent
+		return node
+
 	def circle_intersect(self, x, y, r):
-		return self.x-r <= x < self.upper_x+r and self.y-r <= y < self.upper_y+r
+		# exact circle-rectangle test, corner cells beyond r are left out
+		lx, ly = self.x, self.y
+		ux, uy = lx+self.width, ly+self.height
+		if x < lx:
+			dx = lx-x
+		elif x > ux:
+			dx = x-ux
+		else:
+			dx = 0
+		if y < ly:
+			dy = ly-y
+		elif y > uy:
+			dy = y-uy
+		else:
+			dy = 0
+		return dx*dx+dy*dy <= r*r
+
+	def grow_item_bounds(self, x, y):
+		b = self.item_bounds
+		if b is None:
+			self.item_bounds = [x, y, x, y]
+		else:
+			if x < b[0]:
+				b[0] = x
+			if y < b[1]:
+				b[1] = y
+			if x > b[2]:
+				b[2] = x
+			if y > b[3]:
+				b[3] = y
+
+	def items_intersect(self, x, y, r):
+		# False when the box around the stored items is farther than r,
+		# always True without tracked bounds
+		b = self.item_bounds
+		if b is None:
+			return True
+		if x < b[0]:
+			dx = b[0]-x
+		elif x > b[2]:
+			dx = x-b[2]
+		else:
+			dx = 0
+		if y < b[1]:
+			dy = b[1]-y
+		elif y > b[3]:
+			dy = y-b[3]
+		else:
+			dy = 0
+		return dx*dx+dy*dy <= r*r
 
 	def find_items(self, x, y):
 		leaf = self.find_leaf(x, y)
@@ -85,8 +174,8 @@ class Node(object):
 		else:
 			return leaf.items
 
-	def find_leaf(self, x, y):
-		selected_node = self
+	def find_leaf(self, x, y, hint=None):
+		selected_node = self if hint is None else self.climb(hint, x, y, 0)
 		while True:
 			if not selected_node.intersect(x, y):
 				return None
@@ -101,8 +190,8 @@ class Node(object):
 					raise RuntimeError("No child intersect point({}, {}), tree generation may be wrong".format(x, y))
 				continue
 
-	def find_leaves(self, x, y, r):
-		to_check_node = [self]
+	def find_leaves(self, x, y, r, hint=None):
+		to_check_node = [self if hint is None else self.climb(hint, x, y, r)]
 		ret = list()
 		while True:
 			if not to_check_node:
@@ -111,16 +200,57 @@ class Node(object):
 			if not node.circle_intersect(x, y, r):
 				continue
 			if node.is_leaf:
-				ret.append(node)
+				if node.items_intersect(x, y, r):
+					ret.append(node)
 				continue
 			for child in node.children:
 				if child.circle_intersect(x, y, r):
 					to_check_node.append(child)
 		return ret
 
+	def center_distance_square(self, x, y):
+		dx = self.x+self.width/2-x
+		dy = self.y+self.height/2-y
+		return dx*dx+dy*dy
+
+	def any_within(self, x, y, r, radius_fn, hint=None):
+		# True as soon as one item lies closer to (x, y) than radius_fn(item),
+		# items for which radius_fn returns None are ignored. r bounds every
+		# radius_fn result and is used for pruning. nodes are visited depth
+		# first with the child nearest to the point first, so crowded
+		# neighbourhoods usually stop at the first leaf. with a hint the search
+		# starts from the hinted node instead of the root, see climb
+		start = self if hint is None else self.climb(hint, x, y, r)
+		metrics = self.metrics
+		if metrics is not None:
+			metrics.count("index.queries")
+		if not start.circle_intersect(x, y, r):
+			return False
+		px, py = self.points.x, self.points.y
+		to_check_node = [start]
+		while to_check_node:
+			node = to_check_node.pop()
+			if metrics is not None:
+				metrics.count("index.nodes_visited")
+			if node.is_leaf:
+				if not node.items_intersect(x, y, r):
+					continue
+				for item in node.items:
+					dis = radius_fn(item)
+					if dis is None:
+						continue
+					dx = px[item]-x
+					dy = py[item]-y
+					if dx*dx+dy*dy < dis*dis:
+						return True
+				continue
+			children = [child for child in node.children if child.circle_intersect(x, y, r)]
+			children.sort(key=lambda child: child.center_distance_square(x, y), reverse=True)
+			to_check_node.extend(children)
+		return False
 
 	def add_item(self, item):
-		x, y = item.x, item.y
+		x, y = self.points.x[item], self.points.y[item]
 		leaf = self.find_leaf(x, y)
 		if leaf is None:
 			return False
@@ -128,9 +258,42 @@ class Node(object):
 			leaf.items.append(item)
 			return True
 
+	def morton_key(self, x, y):
+		# y bits above x bits, so the curve visits children in Node.children order
+		ix = min(max(int((x-self.x)/self.width*MORTON_SIDE), 0), MORTON_SIDE-1)
+		iy = min(max(int((y-self.y)/self.height*MORTON_SIDE), 0), MORTON_SIDE-1)
+		return spread_bits(ix) | (spread_bits(iy) << 1)
+
+	def descend(self, path, x, y):
+		# extend path (root first) from its last node down to the leaf holding (x, y)
+		node = path[-1]
+		while not node.is_leaf:
+			for child in node.children:
+				if child.intersect(x, y):
+					node = child
+					break
+			else:
+				raise RuntimeError("No child intersect point({}, {}), tree generation may be wrong".format(x, y))
+			path.append(node)
+		return node
+
+	def store_item(self, leaf, item):
+		leaf.items.append(item)
+
 	def extend_items(self, items):
-		for item in items:
-			self.add_item(item)
+		# bulk insert: sorted along a Z-order curve, consecutive items share most
+		# of their root-to-leaf path, so each one only climbs the current path as
+		# far as needed instead of descending from the root again
+		px, py = self.points.x, self.points.y
+		path = [self]
+		for item in sorted(items, key=lambda item: self.morton_key(px[item], py[item])):
+			x, y = px[item], py[item]
+			while path and not path[-1].intersect(x, y):
+				path.pop()
+			if not path:
+				path.append(self)
+				continue
+			self.store_item(self.descend(path, x, y), item)
 
 	def __repr__(self):
 		return "Node<x={x}, y={y}, width={width}, height={height}, depth={depth}, min_size={min_size}".format(x=self.x, y=self.y, width=self.width, height=self.height, depth=self.depth, min_size=self.min_size)
@@ -141,6 +304,39 @@ class Node(object):
 			child.print_tree()
 
 class IncTree(Node):
+	# with bucket_size set, a leaf keeps up to bucket_size items and is only
+	# split (moving its items down) when one more arrives, otherwise every
+	# item is pushed down to a leaf that can not spawn anymore.
+	# with tight_bounds set, every leaf keeps the bounding box of its items,
+	# so queries can skip leaves whose items all sit far away.
+	# with finger_search set, the leaf of the last query or insertion is used
+	# as hint whenever the caller gives none, so spatially coherent
+	# operations skip most of the root-to-leaf descent
+	def __init__(self, x, y, width, height, depth, min_size, bucket_size=None, tight_bounds=False, finger_search=False, points=None):
+		super(IncTree, self).__init__(x, y, width, height, depth, min_size, points)
+		self.bucket_size = bucket_size
+		self.tight_bounds = tight_bounds
+		self.finger_search = finger_search
+		self.finger = self
+
+	def find_leaf(self, x, y, hint=None):
+		if hint is None and self.finger_search:
+			hint = self.finger
+		leaf = super(IncTree, self).find_leaf(x, y, hint)
+		if leaf is not None:
+			self.finger = leaf
+		return leaf
+
+	def find_leaves(self, x, y, r, hint=None):
+		if hint is None and self.finger_search:
+			hint = self.find_leaf(x, y) or self.finger
+		return super(IncTree, self).find_leaves(x, y, r, hint)
+
+	def any_within(self, x, y, r, radius_fn, hint=None):
+		if hint is None and self.finger_search:
+			hint = self.find_leaf(x, y) or self.finger
+		return super(IncTree, self).any_within(x, y, r, radius_fn, hint)
+
 	def generate_tree(self):
 		print("need not call generate_tree")
 
@@ -151,11 +347,14 @@ class IncTree(Node):
 		print("need not call loop_generate")
 
 	def add_item(self, item):
-		x, y = item.x, item.y
+		if self.bucket_size is not None:
+			return self.add_item_to_bucket(item)
+		x, y = self.points.x[item], self.points.y[item]
 		leaf = self.find_leaf(x, y)
 		while True:
 			if not leaf.can_spawn:
-				leaf.items.append(item)
+				self.store_item(leaf, item)
+				self.finger = leaf
 				break
 			else:
 				leaf.add_children_nodes()
@@ -166,18 +365,302 @@ class IncTree(Node):
 				else:
 					break
 
+	def descend(self, path, x, y):
+		if self.bucket_size is not None:
+			return super(IncTree, self).descend(path, x, y)
+		node = path[-1]
+		while node.add_children_nodes():
+			for child in node.children:
+				if child.intersect(x, y):
+					node = child
+					break
+			else:
+				break
+			path.append(node)
+		return node
+
+	def store_item(self, leaf, item):
+		leaf.items.append(item)
+		if self.tight_bounds:
+			leaf.grow_item_bounds(self.points.x[item], self.points.y[item])
+		if self.bucket_size is not None:
+			self.split_bucket(leaf)
+
+	def can_split(self, leaf):
+		return leaf.depth < BUCKET_MAX_DEPTH and (leaf.height >= 2*leaf.min_size or leaf.width >= 2*leaf.min_size)
+
+	def add_item_to_bucket(self, item):
+		leaf = self.find_leaf(self.points.x[item], self.points.y[item])
+		if leaf is None:
+			return False
+		self.store_item(leaf, item)
+		return True
+
+	def split_bucket(self, leaf):
+		px, py = self.points.x, self.points.y
+		while len(leaf.items) > self.bucket_size and self.can_split(leaf):
+			leaf.spawn_children()
+			items = leaf.items
+			leaf.items = list()
+			leaf.item_bounds = None
+			for it in items:
+				for child in leaf.children:
+					if child.intersect(px[it], py[it]):
+						child.items.append(it)
+						if self.tight_bounds:
+							child.grow_item_bounds(px[it], py[it])
+						break
+			# bucket_size+1 items were moved, at most one child can overflow
+			for child in leaf.children:
+				if len(child.items) > self.bucket_size:
+					leaf = child
+					break
+			else:
+				break
+
+class FlatLeaf(object):
+	# short-lived view on a FlatTree leaf, so callers can keep using leaf.items
+	__slots__ = ("tree", "index")
+
+	def __init__(self, tree, index):
+		self.tree = tree
+		self.index = index
+
+	@property
+	def items(self):
+		return self.tree.leaf_items(self.index)
+
+	def __repr__(self):
+		return "FlatLeaf<index={}>".format(self.index)
+
+class FlatTree(object):
+	# struct-of-arrays quadtree, node i is described by
+	#   xs[i], ys[i]     lower corner, the size follows from depths[i]
+	#   first_child[i]   index of its 4 children (stored contiguously), -1 for a leaf
+	#   item_head[i]     first item of the leaf, items are chained through item_next
+	# children are ordered like Node.children: (x, y), (x+w, y), (x, y+h), (x+w, y+h)
+	# items are point ids of points, like in Node
+	def __init__(self, x, y, width, height, depth, min_size, max_depth=MAX_DEPTH, points=None):
+		self.x = x
+		self.y = y
+		self.width = width
+		self.height = height
+		self.depth = depth
+		self.min_size = min_size
+		self.max_depth = max_depth
+		self.points = points
+		self.metrics = None
+		self.widths = [width/2**(d-depth) if d >= depth else None for d in range(max_depth+1)]
+		self.heights = [height/2**(d-depth) if d >= depth else None for d in range(max_depth+1)]
+		self.spawnable = [depth <= d < max_depth and (self.heights[d] >= 2*min_size or self.widths[d] >= 2*min_size) for d in range(max_depth+1)]
+		self.xs = array("d", [x])
+		self.ys = array("d", [y])
+		self.depths = array("B", [depth])
+		self.first_child = array("i", [-1])
+		self.item_head = array("i", [-1])
+		self.item_next = array("i")
+		self.items = array("i")
+
+	@property
+	def node_count(self):
+		return len(self.xs)
+
+	@property
+	def upper_x(self):
+		return self.x+self.width
+
+	@property
+	def upper_y(self):
+		return self.y+self.height
+
+	def nbytes(self):
+		arrays = (self.xs, self.ys, self.depths, self.first_child, self.item_head, self.item_next, self.items)
+		return sum(a.itemsize*len(a) for a in arrays)
+
+	def add_children_nodes(self, i):
+		if not self.spawnable[self.depths[i]]:
+			return False
+		if self.first_child[i] >= 0:
+			return True
+		d = self.depths[i]+1
+		cw = self.widths[d]
+		ch = self.heights[d]
+		x, y = self.xs[i], self.ys[i]
+		self.first_child[i] = len(self.xs)
+		self.xs.extend((x, x+cw, x, x+cw))
+		self.ys.extend((y, y, y+ch, y+ch))
+		self.depths.extend((d, d, d, d))
+		self.first_child.extend((-1, -1, -1, -1))
+		self.item_head.extend((-1, -1, -1, -1))
+		return True
+
+	def generate_tree(self):
+		to_generate_list = deque()
+		to_generate_list.append(0)
+		while to_generate_list:
+			i = to_generate_list.popleft()
+			if self.add_children_nodes(i):
+				fc = self.first_child[i]
+				to_generate_list.extend((fc, fc+1, fc+2, fc+3))
+
+	def child_for(self, i, x, y):
+		d = self.depths[i]+1
+		child = self.first_child[i]
+		if x >= self.xs[i]+self.widths[d]:
+			child += 1
+		if y >= self.ys[i]+self.heights[d]:
+			child += 2
+		return child
+
+	def intersect(self, x, y):
+		return self.x <= x < self.upper_x and self.y <= y < self.upper_y
+
+	def find_leaf_index(self, x, y):
+		if not self.intersect(x, y):
+			return -1
+		i = 0
+		first_child = self.first_child
+		while first_child[i] >= 0:
+			i = self.child_for(i, x, y)
+		return i
+
+	def find_leaf(self, x, y):
+		i = self.find_leaf_index(x, y)
+		if i < 0:
+			return None
+		return FlatLeaf(self, i)
+
+	def find_items(self, x, y):
+		leaf = self.find_leaf(x, y)
+		if leaf is None:
+			return None
+		else:
+			return leaf.items
+
+	def find_leaf_indices(self, x, y, r):
+		ret = list()
+		if not (self.x-r <= x < self.upper_x+r and self.y-r <= y < self.upper_y+r):
+			return ret
+		xs, ys, depths, first_child = self.xs, self.ys, self.depths, self.first_child
+		widths, heights = self.widths, self.heights
+		rr = r*r
+		to_check_node = [0]
+		while to_check_node:
+			i = to_check_node.pop()
+			fc = first_child[i]
+			if fc < 0:
+				ret.append(i)
+				continue
+			d = depths[i]+1
+			w, h = widths[d], heights[d]
+			for child in (fc, fc+1, fc+2, fc+3):
+				cx, cy = xs[child], ys[child]
+				dx = max(cx-x, 0, x-cx-w)
+				dy = max(cy-y, 0, y-cy-h)
+				if dx*dx+dy*dy <= rr:
+					to_check_node.append(child)
+		return ret
+
+	def find_leaves(self, x, y, r):
+		return [FlatLeaf(self, i) for i in self.find_leaf_indices(x, y, r)]
+
+	def any_within(self, x, y, r, radius_fn):
+		# same contract as Node.any_within
+		metrics = self.metrics
+		if metrics is not None:
+			metrics.count("index.queries")
+		if not (self.x-r <= x < self.upper_x+r and self.y-r <= y < self.upper_y+r):
+			return False
+		xs, ys, depths, first_child = self.xs, self.ys, self.depths, self.first_child
+		widths, heights = self.widths, self.heights
+		items, item_head, item_next = self.items, self.item_head, self.item_next
+		px, py = self.points.x, self.points.y
+		rr = r*r
+		to_check_node = [0]
+		while to_check_node:
+			i = to_check_node.pop()
+			if metrics is not None:
+				metrics.count("index.nodes_visited")
+			fc = first_child[i]
+			if fc < 0:
+				k = item_head[i]
+				while k >= 0:
+					item = items[k]
+					k = item_next[k]
+					dis = radius_fn(item)
+					if dis is None:
+						continue
+					dx = px[item]-x
+					dy = py[item]-y
+					if dx*dx+dy*dy < dis*dis:
+						return True
+				continue
+			d = depths[i]+1
+			w, h = widths[d], heights[d]
+			children = list()
+			for child in (fc, fc+1, fc+2, fc+3):
+				cx, cy = xs[child], ys[child]
+				dx = max(cx-x, 0, x-cx-w)
+				dy = max(cy-y, 0, y-cy-h)
+				if dx*dx+dy*dy <= rr:
+					dx = cx+w/2-x
+					dy = cy+h/2-y
+					children.append((dx*dx+dy*dy, child))
+			children.sort(reverse=True)
+			to_check_node.extend(child for _, child in children)
+		return False
+
+	def leaf_items(self, i):
+		ret = list()
+		items, item_next = self.items, self.item_next
+		k = self.item_head[i]
+		while k >= 0:
+			ret.append(items[k])
+			k = item_next[k]
+		return ret
+
+	def add_item(self, item):
+		x, y = self.points.x[item], self.points.y[item]
+		i = self.find_leaf_index(x, y)
+		if i < 0:
+			return False
+		while self.add_children_nodes(i):
+			i = self.child_for(i, x, y)
+		k = len(self.items)
+		self.items.append(item)
+		self.item_next.append(self.item_head[i])
+		self.item_head[i] = k
+		return True
+
+	def extend_items(self, items):
+		for item in items:
+			self.add_item(item)
+
+	def __repr__(self):
+		return "FlatTree<x={x}, y={y}, width={width}, height={height}, depth={depth}, min_size={min_size}, nodes={nodes}>".format(x=self.x, y=self.y, width=self.width, height=self.height, depth=self.depth, min_size=self.min_size, nodes=self.node_count)
+
 if __name__ == "__main__":
 	import time
 	import sys
 	import os
 	import psutil
-	import cPickle
+	try:
+		import cPickle as pickle
+	except ImportError:
+		import pickle
 	#start = time.time()
 	#a = Node(0, 0, 1024, 1024, 0, 0.1)
 	#a.recursive_generate()
 	#print(time.time()-start)
 	try:
 		start = time.time()
+		if len(sys.argv) > 1 and sys.argv[1] == "flat":
+			# the same pregenerated tree one level deeper than Node can afford
+			f = FlatTree(0, 0, 1024, 1024, 0, 0.1, MAX_DEPTH+1)
+			f.generate_tree()
+			print(time.time()-start)
+			print("FlatTree f has {} nodes in {} bytes of arrays".format(f.node_count, f.nbytes()))
+			sys.exit(0)
 		b = Node(0, 0, 1024, 1024, 0, 0.1)
 		print("Memory size of Node b is {} bytes".format(sys.getsizeof(b)))
 		print("Memory size of b.children is {} bytes".format(sys.getsizeof(b.children)))
@@ -186,8 +669,8 @@ if __name__ == "__main__":
 		#print("Memory size of Node b is {} bytes".format(sys.getsizeof(b)))
 		print("Memory size of b.children is {} bytes".format(sys.getsizeof(b.children)))
 		print("Memory size of b.items is {} bytes".format(sys.getsizeof(b.items)))
-		p_s = cPickle.dumps(b)
-		print("cPickled Node b length is {}".format(len(p_s)))
+		p_s = pickle.dumps(b)
+		print("pickled Node b length is {}".format(len(p_s)))
 		sys.exit(0)
 	except Exception as e:
 		print(str(e))
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+from array import array
+from bisect import bisect_right
+import random
+import time
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+BLOCK_SIZE = 4096
+
+def clock_seed():
+	# fits the 32 bits numpy.random.RandomState takes
+	return int(time.time()*1000000) % (1 << 32)
+
+class BlockRandom(object):
+	# every random number of a run comes from this one seeded generator. it is
+	# a numpy Generator when numpy has one, a RandomState on older numpy and
+	# random.Random without numpy, so a seed reproduces a run only on the
+	# same kind of generator.
+	# numbers are drawn block_size at a time and handed out from python lists,
+	# a block is refilled when it runs out. generate_it takes one step per
+	# iteration, a (u, choice, side) tuple: u in [0, 1) picks the frontier
+	# point, choice is 0, 1 or 2 with probability p1, p2, p3 and side is 0 or
+	# 1 with equal odds
+	def __init__(self, seed=None, weights=(1.0,), block_size=BLOCK_SIZE):
+		if seed is None:
+			seed = clock_seed()
+		self.seed = seed
+		self.block_size = block_size
+		# choice is the number of these bounds at or below a uniform draw
+		self.bounds = list()
+		total = 0.0
+		for w in weights[:-1]:
+			total += w
+			self.bounds.append(total)
+		if numpy is None:
+			self.generator = random.Random(seed)
+		elif hasattr(numpy.random, "default_rng"):
+			self.generator = numpy.random.default_rng(seed)
+		else:
+			self.generator = numpy.random.RandomState(seed)
+		self.steps = list()
+		self.step_pos = 0
+		self.uniforms = list()
+		self.uniform_pos = 0
+
+	def uniform_block(self, n):
+		generator = self.generator
+		if numpy is None:
+			return [generator.random() for i in range(n)]
+		if hasattr(generator, "random_sample"):
+			return generator.random_sample(n)
+		return generator.random(n)
+
+	def fill_steps(self):
+		n = self.block_size
+		us = self.uniform_block(n)
+		cs = self.uniform_block(n)
+		ss = self.uniform_block(n)
+		if numpy is None:
+			cs = [bisect_right(self.bounds, c) for c in cs]
+			ss = [int(s >= 0.5) for s in ss]
+		else:
+			cs = numpy.searchsorted(self.bounds, cs, side="right").tolist()
+			ss = (ss >= 0.5).astype(int).tolist()
+			us = us.tolist()
+		self.steps = list(zip(us, cs, ss))
+		self.step_pos = 0
+
+	def step(self):
+		pos = self.step_pos
+		if pos == len(self.steps):
+			self.fill_steps()
+			pos = 0
+		self.step_pos = pos+1
+		return self.steps[pos]
+
+	def random(self):
+		pos = self.uniform_pos
+		if pos == len(self.uniforms):
+			self.uniforms = list(self.uniform_block(self.block_size))
+			pos = 0
+		self.uniform_pos = pos+1
+		return self.uniforms[pos]
+
+	def randrange(self, start, stop):
+		# u < 1, so int(u*n) < n
+		return start+int(self.random()*(stop-start))
+
+	def generator_state(self):
+		generator = self.generator
+		if numpy is None:
+			return generator.getstate()
+		elif hasattr(generator, "get_state"):
+			return generator.get_state()
+		return generator.bit_generator.state
+
+	def get_state(self):
+		# everything needed to continue the same sequence: the generator state
+		# and what is left of the current blocks
+		steps = self.steps[self.step_pos:]
+		return {
+			"seed": self.seed,
+			"generator": self.generator_state(),
+			"u": array("d", [step[0] for step in steps]),
+			"choice": array("b", [step[1] for step in steps]),
+			"side": array("b", [step[2] for step in steps]),
+			"uniforms": array("d", self.uniforms[self.uniform_pos:]),
+		}
+
+	def set_state(self, state):
+		generator = self.generator
+		if numpy is None:
+			generator.setstate(state["generator"])
+		elif hasattr(generator, "set_state"):
+			generator.set_state(state["generator"])
+		else:
+			generator.bit_generator.state = state["generator"]
+		self.seed = state["seed"]
+		self.steps = list(zip(state["u"], state["choice"], state["side"]))
+		self.step_pos = 0
+		self.uniforms = list(state["uniforms"])
+		self.uniform_pos = 0
+
+	def __repr__(self):
+		return "BlockRandom<seed={}>".format(self.seed)
+
+if __name__ == "__main__":
+	import sys
+	import timeit
+	number = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+	weights = (0.6, 0.35, 0.05)
+	bounds = (0.6, 0.95)
+	def python_step():
+		u = random.randint(0, 999)
+		c = random.random()
+		c = 0 if c < bounds[0] else 1 if c < bounds[1] else 2
+		s = 0 if random.random() < 0.5 else 1
+		return u, c, s
+	r = BlockRandom(1, weights)
+	def block_step():
+		u, c, s = r.step()
+		return int(u*1000), c, s
+	counts = [0, 0, 0]
+	for i in range(number):
+		counts[r.step()[1]] += 1
+	print("choice frequencies: {}".format([c/number for c in counts]))
+	for name, stmt in [("random module", python_step), ("BlockRandom", block_step)]:
+		best = min(timeit.repeat(stmt, number=number, repeat=3))
+		print("{}: {:.3f} us per step".format(name, best/number*1e6))
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function
+import shutil
+import tempfile
+import time
+
+import psdrawer
+
+# a sink is handed the ids of the accepted points batch by batch while the
+# Simulator grows (Simulator.stream), together with the Simulator to read
+# them from. the ids of a batch are consecutive, and every point but the
+# first of a tree brings the edge (points.parent[pid], pid)
+
+# steps generate_it takes between two batches
+BATCH_STEPS = 10000
+
+class Sink(object):
+	def open(self, s):
+		pass
+
+	def write(self, s, pids):
+		pass
+
+	def close(self, s):
+		pass
+
+class PointsCsv(Sink):
+	# points.csv as Simulator.save_points writes it. the counts in the first
+	# line are only known at the end, so the rows wait in a temporary file
+	def __init__(self, filename, directions):
+		self.filename = filename
+		self.directions = directions
+
+	def open(self, s):
+		self.rows = tempfile.TemporaryFile(mode="w+")
+
+	def write(self, s, pids):
+		points = s.points
+		first, stop = pids[0], pids[-1]+1
+		xs, ys = points.x[first:stop], points.y[first:stop]
+		ns = self.directions(xs, ys, s.t)
+		self.rows.write("".join("\n{},{},{},{},{}".format(x, y, r, float(n), idx) for x, y, r, n, idx in zip(xs, ys, points.r[first:stop], ns, points.tree[first:stop])))
+
+	def close(self, s):
+		points = s.points
+		with open(self.filename, "w") as fp:
+			fp.write("{},{},{}".format(len(points), sum(points.is_node), sum(points.is_endpoint)))
+			self.rows.seek(0)
+			shutil.copyfileobj(self.rows, fp)
+		self.rows.close()
+
+class LinesCsv(Sink):
+	# lines.csv as Simulator.save_lines writes it
+	def __init__(self, filename):
+		self.filename = filename
+
+	def open(self, s):
+		self.fp = open(self.filename, "w")
+
+	def write(self, s, pids):
+		xs, ys, parents = s.points.x, s.points.y, s.points.parent
+		self.fp.write("".join("{}, {}, {}, {}\n".format(xs[parent], ys[parent], xs[child], ys[child]) for child, parent in ((c, parents[c]) for c in pids) if parent >= 0))
+
+	def close(self, s):
+		self.fp.close()
+
+class AxisCsv(Sink):
+	# xNx.csv or yNy.csv. they count the points in unit steps from the final
+	# minimum, so they are written from the point columns at the end
+	def __init__(self, axis_name):
+		self.axis_name = axis_name
+
+	def close(self, s):
+		s.save_csv(self.axis_name)
+
+class Eps(Sink):
+	# the eps file of Simulator.draw. the scale depends on the final bounds,
+	# so circles and lines are written in point coordinates to temporary
+	# files, and the eps file is put together at the end with a transform
+	# from point to page coordinates in front of them
+	def __init__(self, filename, background_color="white", circle_color="black", line_color="black", line_weight=0.1, circles=True, lines=True):
+		self.filename = filename
+		self.background_color = background_color
+		self.circle_color = circle_color
+		self.line_color = line_color
+		self.line_weight = line_weight
+		self.circles = circles
+		self.lines = lines
+
+	def open(self, s):
+		self.circle_fp = tempfile.TemporaryFile(mode="w+")
+		self.line_fp = tempfile.TemporaryFile(mode="w+")
+
+	def write(self, s, pids):
+		points = s.points
+		xs, ys, rs, parents = points.x, points.y, points.r, points.parent
+		if self.circles is True:
+			self.circle_fp.write("".join("%.5f %.5f %.5f 0 360 arc\nfill\nstroke\n" % (xs[p], ys[p], rs[p]) for p in pids))
+		if self.lines is True:
+			self.line_fp.write("".join("%.5f %.5f moveto\n%.5f %.5f lineto\nstroke\n" % (xs[parent], ys[parent], xs[child], ys[child]) for child, parent in ((c, parents[c]) for c in pids) if parent >= 0))
+
+	def close(self, s):
+		width, height, x_scale, y_scale, addition_bound = s.page_geometry()
+		drawer = psdrawer.PsDrawer(self.filename, width, height)
+		drawer.set_background(self.background_color)
+		fd = drawer.fd
+		fd.append("%.9f %.9f scale" % (x_scale, y_scale))
+		fd.append("%.9f %.9f translate" % (addition_bound-s.min_x, addition_bound-s.min_y))
+		for color, fp in [(self.circle_color, self.circle_fp), (self.line_color, self.line_fp)]:
+			drawer.change_color(color)
+			if fp is self.line_fp:
+				# Simulator.draw scales line_weight by the mean of the two scales
+				fd.append("%.5f setlinewidth" % (self.line_weight*(x_scale+y_scale)/2/x_scale))
+			fp.seek(0)
+			for chunk in iter(lambda: fp.read(1 << 16), ""):
+				fd.write(chunk)
+			fp.close()
+		drawer.close()
+
+class Stats(Sink):
+	# running counts: points, nodes, edges, points per tree, bounds, and the
+	# size of the frontier and the time at every batch
+	def open(self, s):
+		self.start = time.time()
+		self.batches = 0
+		self.points = 0
+		self.nodes = 0
+		self.edges = 0
+		self.per_tree = [0]*s.M
+		self.min_x = self.min_y = float("inf")
+		self.max_x = self.max_y = float("-inf")
+		self.timeline = list()
+
+	def write(self, s, pids):
+		points = s.points
+		first, stop = pids[0], pids[-1]+1
+		xs, ys = points.x[first:stop], points.y[first:stop]
+		self.batches += 1
+		self.points += len(xs)
+		self.nodes += sum(points.is_node[first:stop])
+		self.edges += len(xs)-points.parent[first:stop].count(-1)
+		for m in points.tree[first:stop]:
+			self.per_tree[m] += 1
+		self.min_x = min(self.min_x, min(xs))
+		self.max_x = max(self.max_x, max(xs))
+		self.min_y = min(self.min_y, min(ys))
+		self.max_y = max(self.max_y, max(ys))
+		self.timeline.append((time.time()-self.start, self.points, len(s.to_generate)))
+
+	def summary(self):
+		return {
+			"batches": self.batches,
+			"points": self.points,
+			"nodes": self.nodes,
+			"edges": self.edges,
+			"per_tree": self.per_tree,
+			"bounds": (self.min_x, self.max_x, self.min_y, self.max_y),
+			"timeline": self.timeline,
+		}
+
+def generate(s, sinks, batch_steps=BATCH_STEPS):
+	# grow s, handing every batch to all sinks as soon as it is accepted
+	for sink in sinks:
+		sink.open(s)
+	for pids in s.stream(batch_steps):
+		for sink in sinks:
+			sink.write(s, pids)
+	for sink in sinks:
+		sink.close(s)